@@ -9,10 +9,13 @@ See:
 import os
 import re
 import sys
+import glob
+import shutil
 import shlex
+import functools
 import unittest
 import subprocess
-from setuptools import setup, find_packages, Command
+from setuptools import setup, Command
 from setuptools.command.test import test
 
 pkg_name = 'yang.connector'
@@ -42,9 +45,18 @@ class CleanCommand(Command):
         pass
 
     def run(self):
-        os.system('rm -vrf ./build ./dist ./src/*.egg-info')
-        os.system('find . -type f -name "*.pyc" | xargs rm -vrf')
-        os.system('find . -type d -name "__pycache__" | xargs rm -vrf')
+        for path in ['./build', './dist'] + glob.glob('./src/*.egg-info'):
+            shutil.rmtree(path, ignore_errors = True)
+
+        # single pass for *.pyc and __pycache__
+        for root, dirs, files in os.walk('.'):
+            for name in files:
+                if name.endswith('.pyc'):
+                    os.unlink(os.path.join(root, name))
+            if '__pycache__' in dirs:
+                dirs.remove('__pycache__')
+                shutil.rmtree(os.path.join(root, '__pycache__'),
+                              ignore_errors = True)
 
 class TestCommand(Command):
     user_options = []
@@ -101,16 +113,18 @@ class BuildAndPreviewDocsCommand(Command):
             sys.exit(1)
 
 
-def read(*paths):
-    '''read and return txt content of file'''
+def read(*paths, size = -1):
+    '''read and return txt content of file (up to size characters)'''
     with open(os.path.join(os.path.dirname(__file__), *paths)) as fp:
-        return fp.read()
+        return fp.read(size)
 
 
+@functools.lru_cache(maxsize = None)
 def find_version(*paths):
     '''reads a file and returns the defined __version__ value'''
+    # __version__ is defined at the top of the module, no need to read it all
     version_match = re.search(r"^__version__ ?= ?['\"]([^'\"]*)['\"]",
-                              read(*paths), re.M)
+                              read(*paths, size = 4096), re.M)
     if version_match:
         return version_match.group(1)
     raise RuntimeError("Unable to find version string.")
@@ -159,7 +173,14 @@ setup(
     keywords = 'pyats cisco-shared',
 
     # project packages
-    packages = find_packages(where = 'src'),
+    # (listed explicitly, keep in sync when adding a sub-package)
+    packages = [
+        'yang',
+        pkg_name,
+        pkg_name + '.grpc',
+        pkg_name + '.proto',
+        pkg_name + '.tests',
+    ],
 
     # project directory
     package_dir = {
@@ -181,7 +202,7 @@ setup(
     install_requires =  [
         'paramiko >= 1.15.1',
         'lxml >= 3.3.0',
-        'ncclient >= 0.6.6',
+        'ncclient >= 0.6.15',
         'grpcio',
         'protobuf'
     ],
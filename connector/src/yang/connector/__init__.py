@@ -18,17 +18,45 @@ __contact__ = 'yang-python@cisco.com'
 __copyright__ = 'Cisco Systems, Inc.'
 
 
-from .netconf import Netconf, NetconfEnxr
-from .gnmi import Gnmi
-from .gnmi import GnmiNotification
-from .grpc import Grpc
-from . import xpath_util
+from importlib import import_module
+
+# public names are resolved on first access so that importing yang.connector
+# does not pull in ncclient, paramiko, lxml, grpcio and protobuf up front
+_LAZY_ATTRS = {
+    'Netconf': ('.netconf', 'Netconf'),
+    'NetconfEnxr': ('.netconf', 'NetconfEnxr'),
+    'NetconfPool': ('.netconf', 'NetconfPool'),
+    'Gnmi': ('.gnmi', 'Gnmi'),
+    'GnmiNotification': ('.gnmi', 'GnmiNotification'),
+    'Grpc': ('.grpc', 'Grpc'),
+    'xpath_util': ('.xpath_util', None),
+}
 
 __all__ = (
     'Netconf',
     'NetconfEnxr',
+    'NetconfPool',
     'Gnmi',
     'GnmiNotification',
     'Grpc',
     'xpath_util'
 )
+
+
+def __getattr__(name):
+    try:
+        module_name, attr = _LAZY_ATTRS[name]
+    except KeyError:
+        raise AttributeError("module '%s' has no attribute '%s'"
+                             % (__name__, name)) from None
+
+    module = import_module(module_name, __name__)
+    value = module if attr is None else getattr(module, attr)
+
+    # cache it so __getattr__ is only hit once per name
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRS))
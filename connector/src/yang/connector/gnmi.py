@@ -1,7 +1,13 @@
 import os
+import stat
+import time
+import queue
+import base64
+import hashlib
 import logging
-from threading import Thread, Event
-from datetime import datetime
+import functools
+from decimal import Decimal
+from threading import Thread, Event, Lock
 from collections import deque
 from google.protobuf import json_format
 import grpc
@@ -31,6 +37,12 @@ except ImportError:
     def to_plaintext(string):
         return string
 
+try:
+    # optional, parses JSON values several times faster
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 from .settings import Settings
 
 # create a logger for this module
@@ -41,18 +53,184 @@ class gNMIException(IOError):
     pass
 
 
+@functools.lru_cache(maxsize=64)
+def _read_certificate(filename, mtime, size):
+    """Read a certificate or key file; cached until the file changes."""
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def _load_certificate(value):
+    """Return the contents of a certificate setting.
+
+    Args:
+      value (str): Path to a PEM file, or the PEM data itself.
+
+    Returns:
+      bytes or str: File contents, value unchanged if it is not a file,
+          or None if it is empty.
+    """
+    if not value:
+        return None
+    try:
+        # one stat both checks for a file and keys the cache
+        st = os.stat(value)
+    except (OSError, ValueError):
+        return value
+    if stat.S_ISREG(st.st_mode):
+        return _read_certificate(value, st.st_mtime_ns, st.st_size)
+    return value
+
+
+_TYPED_VALUE_DECODERS = {
+    'json_ietf_val': lambda val: json_loads(val.json_ietf_val),
+    'json_val': lambda val: json_loads(val.json_val),
+    'decimal_val': lambda val: Decimal(val.decimal_val.digits).scaleb(
+        -val.decimal_val.precision),
+    'leaflist_val': lambda val: [
+        decode_typed_value(element) for element in val.leaflist_val.element],
+}
+
+
+def decode_typed_value(val):
+    """Return the python value held in a gNMI TypedValue.
+
+    Meant for decoders used with decode_proto: scalar PROTO encoded values
+    are returned as is and only JSON values are parsed.
+
+    Args:
+      val (proto.gnmi_pb2.TypedValue): Value of an update.
+
+    Returns:
+      Value of whichever field is set, None if no field is set.
+    """
+    kind = val.WhichOneof('value')
+    if kind is None:
+        return None
+    decoder = _TYPED_VALUE_DECODERS.get(kind)
+    if decoder:
+        return decoder(val)
+    return getattr(val, kind)
+
+
+# Channels shared by connections with GRPC_SHARE_CHANNELS set:
+# key -> [channel, number of connections using it]
+_shared_channels = {}
+_shared_channels_lock = Lock()
+
+
+def _acquire_channel(key, create):
+    """Return the shared channel for key, calling create() if there is none."""
+    with _shared_channels_lock:
+        entry = _shared_channels.get(key)
+        if entry is None:
+            entry = _shared_channels[key] = [create(), 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def _release_channel(key):
+    """Drop one user of a shared channel, closing it after the last one."""
+    with _shared_channels_lock:
+        entry = _shared_channels.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del _shared_channels[key]
+            entry[0].close()
+
+
+# json_format.MessageToDict rendering of the common TypedValue fields
+_TYPED_VALUE_DICT = {
+    'json_ietf_val': lambda val: {
+        'jsonIetfVal': base64.b64encode(val.json_ietf_val).decode()},
+    'json_val': lambda val: {
+        'jsonVal': base64.b64encode(val.json_val).decode()},
+    'string_val': lambda val: {'stringVal': val.string_val},
+    'ascii_val': lambda val: {'asciiVal': val.ascii_val},
+    # 64 bit integers are strings in the JSON mapping
+    'int_val': lambda val: {'intVal': str(val.int_val)},
+    'uint_val': lambda val: {'uintVal': str(val.uint_val)},
+    'bool_val': lambda val: {'boolVal': val.bool_val},
+}
+
+
+def _update_to_dict(update):
+    """Same as json_format.MessageToDict(update), read field by field.
+
+    Updates using deprecated fields or values other than JSON, string,
+    integer or bool are left to MessageToDict.
+    """
+    path = update.path
+    val = update.val
+    kind = val.WhichOneof('value')
+    if update.HasField('value') or update.duplicates or path.element or \
+            (kind is not None and kind not in _TYPED_VALUE_DICT):
+        return json_format.MessageToDict(update)
+    result = {}
+    if update.HasField('path'):
+        path_dict = result['path'] = {}
+        if path.origin:
+            path_dict['origin'] = path.origin
+        if path.elem:
+            elems = path_dict['elem'] = []
+            for elem in path.elem:
+                elem_dict = {'name': elem.name} if elem.name else {}
+                if elem.key:
+                    elem_dict['key'] = dict(elem.key)
+                elems.append(elem_dict)
+        if path.target:
+            path_dict['target'] = path.target
+    if update.HasField('val'):
+        result['val'] = _TYPED_VALUE_DICT[kind](val) if kind else {}
+    return result
+
+
+# Put on the response queue by the reader when the stream ends
+_STREAM_END = object()
+
+
 class GnmiNotification(Thread):
     """Thread listening for event notifications from the device."""
 
+    # Responses received but not yet processed before the reader waits
+    queue_size = 1000
+    # Seconds to wait for the reader to exit once the stream is cancelled
+    reader_join_timeout = 5
+
     def __init__(self, device, response, **request):
         Thread.__init__(self)
         self.device = device
         self._stop_event = Event()
-        self.log = logging.getLogger(__name__)
-        self.log.setLevel(logging.DEBUG)
+        self._result_event = Event()
+        self.log = log
         self.request = request
         self.responses = response
 
+    @property
+    def result(self):
+        return self._result
+
+    @result.setter
+    def result(self, result):
+        self._result = result
+        if result is None:
+            self._result_event.clear()
+        else:
+            self._result_event.set()
+
+    def wait_for_result(self, timeout=None):
+        """Block until a result is set.
+
+        Args:
+          timeout (float): Seconds to wait, None to wait forever.
+
+        Returns:
+          bool: False if the timeout expired without a result.
+        """
+        return self._result_event.wait(timeout)
+
     @property
     def request(self):
         return self._request
@@ -64,6 +242,8 @@ class GnmiNotification(Thread):
         self.returns = request.get('returns')
         self.response_verify = request.get('verifier')
         self.decode_response = request.get('decode')
+        # hand the decoder gnmi_pb2.Update messages instead of dicts
+        self.decode_proto = request.get('decode_proto', False)
         self.namespace = request.get('namespace')
         self.sub_mode = request['format'].get('sub_mode', 'SAMPLE')
         self.encoding = request['format'].get('encoding', 'PROTO')
@@ -77,52 +257,120 @@ class GnmiNotification(Thread):
     def process_opfields(self, response):
         """Decode response and verify result.
 
-        Decoder callback returns desired format of response.
+        Decoder callback returns desired format of response. It is called
+        with each update in json_format.MessageToDict form, where
+        jsonIetfVal/jsonVal are base64 strings, or, if the request sets
+        decode_proto, with the gnmi_pb2.Update itself; decode_typed_value
+        gets the value from update.val without any base64 or, for PROTO
+        encoding, JSON step, and xpath_util.path_to_xpath gets the xpath
+        from update.path.
         Verify callback returns verification of expected results.
 
         Args:
-          response (proto.gnmi_pb2.Notification): Contains updates that
-              have changes since last timestamp.
+          response (proto.gnmi_pb2.SubscribeResponse): Contains updates
+              that have changes since last timestamp.
         """
-        subscribe_resp = json_format.MessageToDict(response)
-        updates = subscribe_resp['update']
-        for update in updates['update']:
-            resp = self.decode_response(update, self.namespace)
+        # Convert the updates one at a time, field by field, instead of
+        # the whole response; the prefix, timestamp and deletes are never
+        # looked at.
+        decode = self.decode_response
+        namespace = self.namespace
+        to_dict = None if self.decode_proto else _update_to_dict
+        for update in response.update.update:
+            # stop() may come from another thread mid response
+            if self.stopped():
+                break
+            if to_dict:
+                update = to_dict(update)
+            resp = decode(update, namespace)
             if self.event_triggered:
                 if resp:
                     if not self.returns:
                         self.log.error('No notification values to check')
                         self.result = False
                         self.stop()
-                    else:
-                        self.result = self.response_verify(
-                            resp, self.returns.copy())
+                        continue
+                    # Verifiers may consume the list they are given and
+                    # every update is checked against all of it.
+                    self.result = self.response_verify(
+                        resp, self.returns.copy())
                 else:
                     self.log.error('No values in subscribe response')
 
+    def _read_responses(self, responses, done):
+        """Move responses from the stream onto the queue.
+
+        Runs in its own thread so receiving is not held up by decoding
+        and verifying in run().
+
+        Args:
+          responses (queue.Queue): Queue read by run().
+          done (threading.Event): Set by run() when it stops reading.
+        """
+        def put(item):
+            while not done.is_set():
+                try:
+                    responses.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for response in self.responses:
+                if not put(response):
+                    return
+        except Exception as exc:
+            put(exc)
+        else:
+            put(_STREAM_END)
+
     def run(self):
         """Check for inbound notifications."""
-        t1 = datetime.now()
+        t1 = time.monotonic()
         self.log.info('\nSubscribe notification active\n{0}'.format(29 * '='))
+        responses = queue.Queue(self.queue_size)
+        done = Event()
+        self._reader = Thread(target=self._read_responses,
+                              args=(responses, done), daemon=True)
+        self._reader.start()
         try:
-            for response in self.responses:
-                self.log.info(response)
+            while True:
+                # Wake up regularly so stop() and stream_max are noticed
+                # while the stream is quiet.
+                try:
+                    response = responses.get(timeout=1)
+                except queue.Empty:
+                    response = None
+                else:
+                    if response is _STREAM_END:
+                        break
+                    if isinstance(response, Exception):
+                        raise response
+                    self.log.info(response)
                 if self.stopped():
                     self.time_delta = self.stream_max
                     self.log.info("Terminating notification thread")
                     break
                 if self.stream_max:
-                    t2 = datetime.now()
-                    td = t2 - t1
-                    self.time_delta = td.seconds
-                    if td.seconds > self.stream_max:
+                    self.time_delta = int(time.monotonic() - t1)
+                    if self.time_delta > self.stream_max:
                         self.stop()
                         break
-                if response.HasField('sync_response'):
+                if response is None:
+                    continue
+                # one oneof lookup instead of a HasField call per field
+                kind = response.WhichOneof('response')
+                if kind == 'sync_response':
                     self.log.info('Subscribe syncing response')
-                if response.HasField('update'):
-                    self.log.info('\nSubscribe response:\n{0}\n{1}'.format(
-                        19 * '=', str(response)))
+                elif kind == 'update':
+                    # str() of a large response is expensive, only build
+                    # the message if it will be logged. It stays
+                    # preformatted since GnmiLogHandler keeps record.msg.
+                    if self.log.isEnabledFor(logging.INFO):
+                        self.log.info(
+                            '\nSubscribe response:\n{0}\n{1}'.format(
+                                19 * '=', str(response)))
                     self.process_opfields(response)
 
         except Exception as exc:
@@ -134,6 +382,14 @@ class GnmiNotification(Thread):
             if not msg:
                 msg = str(exc)
             self.result = msg
+        finally:
+            done.set()
+            # The reader is blocked in the stream until the server sends
+            # something, cancel the call so it and the stream go away.
+            cancel = getattr(self.responses, 'cancel', None)
+            if cancel is not None:
+                cancel()
+                self._reader.join(self.reader_join_timeout)
 
     def stop(self):
         self.log.info("Stopping notification stream")
@@ -237,11 +493,15 @@ class Gnmi(BaseConnection):
         chain = None
         private_key = None
         self.channel = None
-        self.results = deque()
         self.metadata = None
 
         # connection_info is set by BaseConnection class
         self.settings = self.connection_info.pop('settings', Settings())
+        # oldest messages are dropped once maxlen are waiting
+        self.results = deque(
+            maxlen=self.settings.get('GNMI_RESULTS_MAXLEN', 10000))
+        self._log_handler = None
+        self._channel_key = None
 
     @property
     def connected(self):
@@ -272,11 +532,12 @@ class Gnmi(BaseConnection):
         else:
             self.log = log
             self.log.setLevel(logging.INFO)
-            gnmi_log_handler = GnmiLogHandler()
-            gnmi_log_handler.gnmi_session = self
-            gnmi_log_handler.setLevel(logging.INFO)
-            log.addHandler(gnmi_log_handler)
-            self.log.addHandler(gnmi_log_handler)
+            # one handler per session, not one more per reconnect
+            if self._log_handler is None:
+                self._log_handler = GnmiLogHandler()
+                self._log_handler.gnmi_session = self
+                self._log_handler.setLevel(logging.INFO)
+                log.addHandler(self._log_handler)
 
         if not username or not password:
             creds = dev_args.get('credentials', '')
@@ -284,7 +545,8 @@ class Gnmi(BaseConnection):
                 raise KeyError('No credentials found for testbed')
             if 'gnmi' not in creds:
                 log.info('Credentials used from {0}'.format(next(iter(creds))))
-            gnmi_uname_pwd = creds.get('')
+            # pyATS Credentials fall back to the default credentials
+            gnmi_uname_pwd = creds.get('gnmi')
             if not gnmi_uname_pwd:
                 raise KeyError('No credentials found for gNMI')
             username = gnmi_uname_pwd.get('username', '')
@@ -306,32 +568,32 @@ class Gnmi(BaseConnection):
         else:
             host = dev_args.get('host') or dev_args.get('ip')
             port = str(dev_args.get('port'))
+        host = str(host)
+        if ':' in host and not host.startswith('['):
+            # IPv6 literal, gRPC expects the address in brackets
+            host = '[{0}]'.format(host)
         target = '{0}:{1}'.format(host, port)
 
-        max_receive_message_length = self.settings.get('GRPC_MAX_RECEIVE_MESSAGE_LENGTH')
-        max_send_message_length = self.settings.get('GRPC_MAX_SEND_MESSAGE_LENGTH')
+        max_receive_message_length = self.settings.get('GRPC_MAX_RECEIVE_MESSAGE_LENGTH', 1000000000)
+        max_send_message_length = self.settings.get('GRPC_MAX_SEND_MESSAGE_LENGTH', 1000000000)
         
         options = [('grpc.max_receive_message_length', max_receive_message_length),
                    ('grpc.max_send_message_length', max_send_message_length)]
+        keepalive_time = self.settings.get('GRPC_KEEPALIVE_TIME_MS')
+        if keepalive_time:
+            # keep quiet subscribe streams from being dropped by middleboxes
+            options.append(('grpc.keepalive_time_ms', keepalive_time))
+        # Any other gRPC channel arguments, e.g.
+        # grpc_options: {grpc.http2.write_buffer_size: 0}
+        options.extend(dev_args.get('grpc_options', {}).items())
 
         # Gather certificate settings
-        root = dev_args.get('root_certificate')
-        if not root:
-            root = None
-        if root and os.path.isfile(root):
-            root = open(root, 'rb').read()
-        chain = dev_args.get('certificate_chain')
-        if not chain:
-            chain = None
-        if chain and os.path.isfile(chain):
-            chain = open(chain, 'rb').read()
-        private_key = dev_args.get('private_key', '')
-        if not private_key:
-            private_key = None
-        if private_key and os.path.isfile(private_key):
-            private_key = open(private_key, 'rb').read()
-
-        if any((root, chain, private_key)):
+        root = _load_certificate(dev_args.get('root_certificate'))
+        chain = _load_certificate(dev_args.get('certificate_chain'))
+        private_key = _load_certificate(dev_args.get('private_key'))
+
+        secure = any((root, chain, private_key))
+        if secure:
             override_name = dev_args.get('ssl_name_override', '')
             if override_name:
                 self.log.info('Host override secure channel')
@@ -355,22 +617,48 @@ class Gnmi(BaseConnection):
             channel_creds = grpc.composite_channel_credentials(
                 channel_ssl_creds, ssl_metadata
             )
-            self.channel = grpc.secure_channel(
-                target, channel_creds, options
+            create_channel = functools.partial(
+                grpc.secure_channel, target, channel_creds, options
             )
         else:
-            self.channel = grpc.insecure_channel(target)
-            self.channel = grpc.insecure_channel(target, options)
+            create_channel = functools.partial(
+                grpc.insecure_channel, target, options
+            )
             self.metadata = [
                 ("username", username),
                 ("password", password),
             ]
             self.log.info("Connecting insecure channel")
 
+        if self._channel_key is not None:
+            # reconnecting, let go of the channel from the last connect
+            _release_channel(self._channel_key)
+            self._channel_key = None
+        if self.settings.get('GRPC_SHARE_CHANNELS', False):
+            # Secure channels carry the credentials, so they are part of
+            # the key; hashed so the key does not hold them.
+            creds = (root, chain, private_key, username, password)
+            self._channel_key = (
+                target,
+                hashlib.sha256(repr(creds).encode()).hexdigest()
+                if secure else None,
+                tuple(options),
+            )
+            self.channel = _acquire_channel(self._channel_key,
+                                            create_channel)
+        else:
+            self.channel = create_channel()
+
         self.service = proto.gnmi_pb2_grpc.gNMIStub(self.channel)
 
 
-        resp = self.capabilities()
+        try:
+            resp = self.capabilities()
+        except Exception:
+            # give back the channel, shared ones would otherwise be kept
+            # open by the refcount taken above
+            self.disconnect()
+            raise
         if resp:
             log.info('\ngNMI version: {0} supported encodings: {1}\n\n'.format(
                 resp.gNMI_version,
@@ -447,8 +735,18 @@ class Gnmi(BaseConnection):
 
     def disconnect(self):
         """Disconnect from SSH device."""
+        notifier = self.active_notifications.pop(self, None)
+        if notifier:
+            notifier.stop()
+        if self._log_handler is not None:
+            # the module logger would otherwise keep this session alive
+            log.removeHandler(self._log_handler)
+            self._log_handler = None
         if self.connected:
-            if self.channel:
+            if self._channel_key is not None:
+                _release_channel(self._channel_key)
+                self._channel_key = None
+            elif self.channel:
                 self.channel.close()
             del self.channel
 
@@ -1,20 +1,31 @@
 """netconf.py module is a wrapper around the ncclient package."""
 
+import os
 import re
 import time
+import socket
+import asyncio
 import atexit
 import logging
+import weakref
+import functools
 import subprocess
 import datetime
+import contextlib
+import collections
+import paramiko
 import lxml.etree as et
 from time import sleep
-from threading import Thread, Event
+from threading import Thread, Event, RLock
 from ncclient import manager
 from ncclient import operations
 from ncclient import transport
 from ncclient.operations.retrieve import GetReply
 from ncclient.devices.default import DefaultDeviceHandler
 from ncclient.operations.errors import TimeoutExpiredError
+from ncclient.transport.errors import TransportError, SessionCloseError
+from ncclient.transport.session import NetconfBase
+from ncclient.transport.parser import DefaultXMLParser
 
 try:
     from pyats.connections import BaseConnection
@@ -38,6 +49,42 @@ nccl = logging.getLogger("ncclient")
 LOG_FORMAT = '%(asctime)s: %%NETCONF-%(levelname)s: %(message)s'
 DATE_FORMAT = '%Y-%m-%dT%H:%M:%S'
 
+# message-id attribute of a raw rpc
+MSG_ID_ATTR = 'message-id="'
+MSG_ID_ATTR_BYTES = MSG_ID_ATTR.encode()
+
+# RFC 6242 framing delimiters
+EOM_DELIM = b']]>]]>'
+CHUNK_HEADER = b'\n#%d\n'
+CHUNK_END = b'\n##\n'
+
+# characters not allowed in a log file name
+LOGFILE_UNSAFE_RE = re.compile(r'[^\w\s-]')
+
+
+@functools.lru_cache(maxsize=8)
+def _parse_known_hosts(filename, mtime):
+    '''Parse a known_hosts file; cached until the file is modified. The
+    returned HostKeys is shared and must not be modified.'''
+    host_keys = paramiko.HostKeys()
+    host_keys.load(filename)
+    return host_keys
+
+
+def _find_message_id(msg):
+    '''Return the message-id of a raw rpc, str or bytes, or None.'''
+    attr = MSG_ID_ATTR if isinstance(msg, str) else MSG_ID_ATTR_BYTES
+    start = msg.find(attr)
+    if start == -1:
+        return None
+    start += len(attr)
+    # attr ends with the opening quote, find the closing one
+    end = msg.find(attr[-1:], start)
+    if end == -1:
+        return None
+    msg_id = msg[start:end]
+    return msg_id if isinstance(msg_id, str) else msg_id.decode('utf-8')
+
 
 def format_xml(msg):
     parser = et.XMLParser(recover=True, remove_blank_text=True)
@@ -48,7 +95,7 @@ def format_xml(msg):
     msg = msg.strip()
 
     start = msg.find(b"<")
-    end = msg.rfind(b"]]>]]>")   # NETCONF 1.0 terminator
+    end = msg.rfind(EOM_DELIM)   # NETCONF 1.0 terminator
 
     if end == -1:
         end = msg.rfind(b">")
@@ -83,6 +130,8 @@ class NetconfFormatter(logging.Formatter):
             msg = msg.xml
         if self.FORMAT_XML:
             record.msg = format_xml(msg)
+        elif isinstance(msg, bytes):
+            record.msg = msg.decode('utf-8', 'replace')
         return super().format(record)
 
 
@@ -156,6 +205,163 @@ class NetconfSessionLogHandler(logging.Handler):
 
 nccl.addHandler(NetconfSessionLogHandler())
 
+# Netconf instances with a session opened by connect()
+_live_sessions = weakref.WeakSet()
+
+
+@atexit.register
+def _close_live_sessions():
+    for nc in list(_live_sessions):
+        try:
+            if nc.session.transport:
+                nc.session.close()
+        except Exception:
+            pass
+
+
+class SSHSession(transport.SSHSession):
+    '''SSHSession
+
+    A ncclient.transport.SSHSession that tunes the paramiko Transport before
+    the NETCONF channel is opened on it. This is for internal use only.
+
+    ncclient creates the Transport and opens the channel within connect(),
+    so the Transport is adjusted as it is assigned to the session. In the
+    same way, ncclient's default parser is swapped for a FramedParser.
+    '''
+
+    # size of each read from the channel, ncclient reads 4KB at a time
+    bufsize = 65536
+
+    def __init__(self, device_handler, window_size=None,
+                 max_packet_size=None):
+        # channel window and packet size requested from the server; the
+        # paramiko defaults (2MB/32KB) throttle large replies
+        self.window_size = window_size
+        self.max_packet_size = max_packet_size
+        self._send_lock = RLock()
+        # framed messages held back while batch() is active
+        self._batch = None
+        super().__init__(device_handler)
+
+    @property
+    def _transport(self):
+        return self._paramiko_transport
+
+    @_transport.setter
+    def _transport(self, transport):
+        if transport is not None:
+            self._tune_transport(transport)
+        self._paramiko_transport = transport
+
+    @property
+    def parser(self):
+        return self._parser
+
+    @parser.setter
+    def parser(self, parser):
+        # ncclient assigns a new parser once connected; keep ours, it may
+        # hold part of a message already
+        if type(parser) is DefaultXMLParser:
+            if isinstance(getattr(self, '_parser', None), FramedParser):
+                return
+            parser = FramedParser(self)
+        self._parser = parser
+
+    def load_known_hosts(self, filename=None):
+        '''Same as ncclient's load_known_hosts, but each file is parsed
+        once per process (again only if it changes) and the result is
+        shared between sessions.'''
+
+        if filename is None:
+            for filename in ('~/.ssh/known_hosts', '~/ssh/known_hosts'):
+                try:
+                    self._add_host_keys(os.path.expanduser(filename))
+                    return
+                except IOError:
+                    pass
+        else:
+            self._add_host_keys(filename)
+
+    def _add_host_keys(self, filename):
+        host_keys = _parse_known_hosts(filename,
+                                       os.stat(filename).st_mtime_ns)
+        if not self._host_keys:
+            self._host_keys = host_keys
+        elif self._host_keys is not host_keys:
+            # never add to a shared HostKeys, merge into a new one
+            merged = paramiko.HostKeys()
+            for keys in (self._host_keys, host_keys):
+                for hostname, entry in keys.items():
+                    for key in entry.values():
+                        merged.add(hostname, key.get_name(), key)
+            self._host_keys = merged
+
+    def _tune_transport(self, transport):
+        if self.window_size:
+            transport.default_window_size = self.window_size
+        if self.max_packet_size:
+            transport.default_max_packet_size = self.max_packet_size
+        # NETCONF is request/response, do not let Nagle hold back the tail
+        # of a small rpc waiting for the ack of the previous segment
+        sock = transport.sock
+        if isinstance(sock, socket.socket) and \
+                sock.family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            except OSError as e:
+                logger.debug('Unable to set TCP_NODELAY: %s', e)
+
+    def _transport_read(self):
+        return self._channel.recv(self.bufsize)
+
+    def send(self, message):
+        '''Frame the message and write it to the channel right away.
+
+        ncclient queues outgoing messages for the session thread, which only
+        looks at the queue between 0.1s selector ticks, adding up to 100ms to
+        every rpc. Writing from the caller also keeps the session thread
+        reading replies while a large rpc is being sent.
+        '''
+        if not self.connected:
+            raise TransportError('Not connected to NETCONF server')
+        # bytes are sent as they are, saving a decode/encode of large rpcs
+        if isinstance(message, str):
+            message = message.encode()
+        if self._base == NetconfBase.BASE_11:
+            data = ChunkedFramer.encode(message)
+        else:
+            data = EomFramer.encode(message)
+        self.logger.info('Sending:\n%s', data)
+        with self._send_lock:
+            if self._batch is not None:
+                self._batch.append(data)
+            else:
+                self._write(data)
+
+    @contextlib.contextmanager
+    def batch(self):
+        '''Hold back the messages sent within the block and write them to
+        the channel together, in one sendall, when the block exits.
+
+        Other threads sending meanwhile wait for the batch to be written.
+        '''
+        with self._send_lock:
+            self._batch = []
+            try:
+                yield
+                data = b''.join(self._batch)
+            finally:
+                self._batch = None
+            if data:
+                self._write(data)
+
+    def _write(self, data):
+        try:
+            self._channel.sendall(data)
+        except OSError:
+            raise SessionCloseError(self._buffer.getvalue(), data)
+
 
 class Netconf(manager.Manager, BaseConnection):
     '''Netconf
@@ -243,6 +449,32 @@ class Netconf(manager.Manager, BaseConnection):
         synchronously (False). The default value is False.
     '''
 
+    # operation names handed over to Manager.__getattr__, computed once
+    # since __getattr__ is hit for every missing attribute lookup
+    _operation_names = frozenset(getattr(manager, 'VENDOR_OPERATIONS', ())) \
+        | frozenset(manager.OPERATIONS)
+
+    # default session.connect() arguments
+    _connect_defaults = {
+        'host': None,
+        'port': 830,
+        'username': None,
+        'password': None,
+        'key_filename': None,
+        'allow_agent': False,
+        'hostkey_verify': False,
+        'look_for_keys': False,
+        'ssh_config': None,
+        }
+
+    # connection_info items not passed on to session.connect()
+    _connect_disregards = frozenset(['class', 'model', 'protocol',
+                                     'async_mode', 'raise_mode',
+                                     'credentials'])
+
+    # session.connect() arguments that have no usable default
+    _connect_required = frozenset(['host'])
+
     def __init__(self, *args, **kwargs):
 
         '''
@@ -273,7 +505,7 @@ class Netconf(manager.Manager, BaseConnection):
         device_handler = DefaultDeviceHandler()
 
         # create the session instance
-        session = transport.SSHSession(device_handler)
+        session = self._create_session(device_handler)
 
         # load known_hosts file (if available)
         if kwargs.get('hostkey_verify'):
@@ -287,6 +519,15 @@ class Netconf(manager.Manager, BaseConnection):
 
         self.active_notifications = {}
 
+    def _create_session(self, device_handler):
+        '''Create an SSH session tuned according to settings.'''
+
+        return SSHSession(
+            device_handler,
+            window_size=self.settings.get('NETCONF_SSH_WINDOW_SIZE', 2**27),
+            max_packet_size=self.settings.get('NETCONF_SSH_MAX_PACKET_SIZE',
+                                              2**15))
+
     @property
     def session(self):
         '''session
@@ -335,9 +576,7 @@ class Netconf(manager.Manager, BaseConnection):
                 pass
 
             ts = datetime.datetime.now().strftime('%Y%m%dT%H%M%S.%f')[:-3].replace('.', '')
-            def convert(string):
-                return re.sub(r'[^\w\s-]', '_', string)
-            sanitized_hostname = convert(hostname)
+            sanitized_hostname = LOGFILE_UNSAFE_RE.sub('_', hostname)
             if self.alias:
                 self.logfile = f'{self.logdir}/{sanitized_hostname}-{self.alias}-{ts}.log'
             else:
@@ -488,26 +727,12 @@ class Netconf(manager.Manager, BaseConnection):
         self.configure_logging()
 
         if not self.session.is_alive():
-            self._session = transport.SSHSession(self._device_handler)
-
-        # default values
-        defaults = {
-            'host': None,
-            'port': 830,
-            'username': None,
-            'password': None,
-            'key_filename': None,
-            'allow_agent': False,
-            'hostkey_verify': False,
-            'look_for_keys': False,
-            'ssh_config': None,
-            }
-        defaults.update(self.connection_info)
-
-        # remove items
-        disregards = ['class', 'model', 'protocol',
-                      'async_mode', 'raise_mode', 'credentials']
-        defaults = {k: v for k, v in defaults.items() if k not in disregards}
+            self._session = self._create_session(self._device_handler)
+
+        # default values, minus the items to remove
+        defaults = dict(self._connect_defaults)
+        defaults.update((k, v) for k, v in self.connection_info.items()
+                        if k not in self._connect_disregards)
 
         # rename ip -> host, cast to str type
         if 'ip' in defaults:
@@ -545,7 +770,18 @@ class Netconf(manager.Manager, BaseConnection):
                                      % (self.via, err))
             del defaults['sshtunnel']
 
-        defaults = {k: getattr(self, k, v) for k, v in defaults.items()}
+        # attributes set on the instance take precedence; look them up
+        # without falling back to the Manager operations __getattr__
+        for k in defaults:
+            try:
+                defaults[k] = object.__getattribute__(self, k)
+            except AttributeError:
+                pass
+
+        missing = [k for k in self._connect_required if defaults[k] is None]
+        if missing:
+            raise KeyError('Connection %s is missing %s (ip or host)'
+                           % (self.via, ', '.join(sorted(missing))))
 
         try:
             self.session.connect(**defaults)
@@ -555,10 +791,27 @@ class Netconf(manager.Manager, BaseConnection):
                 self.session.close()
             raise
 
-        @atexit.register
-        def cleanup():
-            if self.session.transport:
-                self.session.close()
+        _live_sessions.add(self)
+
+    async def connect_async(self):
+        '''connect_async
+
+        High-level api: coroutine version of connect. The SSH handshake and
+        capability exchange run in the event loop's default executor, so
+        many devices can be connected concurrently from a single event loop.
+        Once connected, use request_async to send rpcs.
+
+        Code Example::
+
+            >>> import asyncio
+            >>> async def connect_all(devices):
+            ...     await asyncio.gather(
+            ...         *[dev.nc.connect_async() for dev in devices])
+            >>> asyncio.run(connect_all(devices))
+        '''
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.connect)
 
     def disconnect(self):
         '''disconnect
@@ -566,6 +819,11 @@ class Netconf(manager.Manager, BaseConnection):
         High-level api: closes the NetConf connection.
         '''
 
+        _live_sessions.discard(self)
+        # don't leave a notification thread listening on a closed session
+        notifier = self.active_notifications.pop(self, None)
+        if notifier:
+            notifier.stop()
         self.session.close()
 
     def subscribe(self, request):
@@ -587,26 +845,24 @@ class Netconf(manager.Manager, BaseConnection):
                 return
             notifier.event_triggered = True
             self.log.info(banner('NOTIFICATION EVENT TRIGGERED'))
+            timeout = float(notifier.stream_max) - 1
+            # A result is not taken before the first sample period is over
             wait_for_sample = notifier.sample_interval - 1
-            cntr = 1.0
-            while cntr < float(notifier.stream_max):
-                self.log.info('Listening for notifications from subscribe stream, {} seconds elapsed'.format(
-                    cntr)
-                )
-                cntr += 1
-                if notifier.result is not None and wait_for_sample <= 0:
-                    notifier.stop()
-                    if notifier.result is True:
-                        steps.passed(
-                            '\n' + banner('NOTIFICATION RESPONSE PASSED')
-                        )
-                    else:
-                        steps.failed(
-                            '\n' + banner('NOTIFICATION RESPONSE FAILED')
-                        )
-                    break
-                sleep(1)
-                wait_for_sample -= 1
+            self.log.info('Listening for notifications from subscribe '
+                          'stream for {} seconds'.format(max(timeout, 0)))
+            start = time.monotonic()
+            if notifier.wait_for_result(timeout) and \
+                    wait_for_sample < timeout:
+                sleep(max(wait_for_sample - (time.monotonic() - start), 0))
+                notifier.stop()
+                if notifier.result is True:
+                    steps.passed(
+                        '\n' + banner('NOTIFICATION RESPONSE PASSED')
+                    )
+                else:
+                    steps.failed(
+                        '\n' + banner('NOTIFICATION RESPONSE FAILED')
+                    )
             else:
                 notifier.stop()
                 steps.failed(
@@ -658,23 +914,21 @@ class Netconf(manager.Manager, BaseConnection):
         '''
 
         # allow for operation string type
-        if type(operation) is str:
-            try:
-                cls = manager.OPERATIONS[operation]
-            except KeyError:
+        if isinstance(operation, str):
+            cls = manager.OPERATIONS.get(operation)
+            if cls is None:
                 raise ValueError('No such operation "%s".\n'
                                  'Supported operations are: %s' %
                                  (operation, list(manager.OPERATIONS.keys())))
         else:
             cls = operation
 
-        time1 = datetime.datetime.now()
+        time1 = time.monotonic()
         reply = super().execute(cls, *args, **kwargs)
-        time2 = datetime.datetime.now()
-        reply.elapsed = time2 - time1
+        reply.elapsed = datetime.timedelta(seconds=time.monotonic() - time1)
         return reply
 
-    def request(self, msg, timeout=30, return_obj=False):
+    def request(self, msg, timeout=None, return_obj=False):
         '''request
 
         High-level api: sends message through NetConf session and returns with
@@ -686,7 +940,7 @@ class Netconf(manager.Manager, BaseConnection):
         Parameters
         ----------
 
-        msg : `str`
+        msg : `str` or `bytes`
             Any message need to be sent out in XML format. The message can be
             in wrong format if it is a negative test case. Because ncclient
             tracks same message-id in both rpc and rpc-reply, missing
@@ -695,8 +949,9 @@ class Netconf(manager.Manager, BaseConnection):
             exception.
         timeout : `int`, optional
             An optional keyed argument to set timeout value in seconds. Its
-            default value is 30 seconds. If timeout is less than 30, 
-            timeout will use the default of 30 seconds.
+            default value is the connection timeout (30 seconds unless
+            timeout is set in the testbed). If timeout is less than the
+            connection timeout, the connection timeout is used.
         return_obj : `boolean`, optional
             Normally a string is returned as a reply. In other cases, we may
             want to return a RPCReply object, so we can access some attributes,
@@ -752,19 +1007,201 @@ class Netconf(manager.Manager, BaseConnection):
             >>>
         '''
 
-        if timeout <= self.timeout:
+        if timeout is None or timeout <= self.timeout:
+            timeout = self.timeout
+
+        rpc = self._raw_rpc(msg, timeout)
+
+        # disable info logging for ncclient
+        nccl.setLevel(logging.WARNING)
+
+        if return_obj:
+            response = rpc._request(msg)
+        else:
+            response = rpc._request(msg).xml
+
+        # enable info logging for ncclient
+        nccl.setLevel(logging.INFO)
+
+        return response
+
+    async def request_async(self, msg, timeout=None, return_obj=False):
+        '''request_async
+
+        High-level api: coroutine version of request. The rpc is sent from
+        the event loop's default executor and the coroutine is resumed by
+        the session thread when the rpc-reply is delivered, so no thread is
+        blocked while waiting. Many requests, to one or many devices, can be
+        awaited concurrently from a single event loop.
+
+        Parameters
+        ----------
+
+        msg : `str` or `bytes`
+            Any message need to be sent out in XML format, see request.
+        timeout : `int`, optional
+            An optional keyed argument to set timeout value in seconds. Its
+            default value is the connection timeout (30 seconds unless
+            timeout is set in the testbed). If timeout is less than the
+            connection timeout, the connection timeout is used.
+        return_obj : `boolean`, optional
+            Return a RPCReply object instead of a string.
+
+        Returns
+        -------
+
+        str or RPCReply
+            The reply from the device in string. If return_obj=True, the
+            reply is a RPCReply object.
+
+        Raises
+        ------
+
+        TimeoutExpiredError
+            If there is a timeout when receiving reply.
+
+
+        Code Example::
+
+            >>> import asyncio
+            >>> async def get_all(devices, rpc):
+            ...     return await asyncio.gather(
+            ...         *[dev.nc.request_async(rpc) for dev in devices])
+            >>> replies = asyncio.run(get_all(devices, netconf_request))
+        '''
+
+        if timeout is None or timeout <= self.timeout:
+            timeout = self.timeout
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def set_result(rpc):
+            if not future.done():
+                future.set_result(rpc)
+
+        def done(rpc):
+            # called from the ncclient session thread
+            loop.call_soon_threadsafe(set_result, rpc)
+
+        rpc = self._raw_rpc(msg, timeout, async_mode=True, done=done)
+        time1 = time.monotonic()
+        # sending blocks while the SSH window is full, keep it off the loop
+        await loop.run_in_executor(None, rpc._request, msg)
+        try:
+            await asyncio.wait_for(
+                future, max(timeout - (time.monotonic() - time1), 0))
+        except asyncio.TimeoutError:
+            self.log.info('Timeout. No rpc-reply received.')
+            raise TimeoutExpiredError('ncclient timed out while waiting '
+                                      'for an rpc-reply.') from None
+        if rpc.error:
+            raise rpc.error
+
+        reply = rpc.reply
+        reply.elapsed = datetime.timedelta(seconds=time.monotonic() - time1)
+        self.log.info('Receiving rpc-reply after %.3f sec...',
+                      reply.elapsed.total_seconds())
+        self.log.info(reply)
+
+        return reply if return_obj else reply.xml
+
+    def request_many(self, msgs, timeout=None, return_obj=False):
+        '''request_many
+
+        High-level api: sends several messages through NetConf session back
+        to back, without waiting for each rpc-reply in between, and returns
+        the replies in the same order. Every message must carry its own
+        message-id, which is how replies are matched to rpcs.
+
+        Parameters
+        ----------
+
+        msgs : `list`
+            Messages in XML format, see request.
+        timeout : `int`, optional
+            Time in seconds to wait for all the replies. Its default value
+            is the connection timeout (30 seconds unless timeout is set in
+            the testbed). If timeout is less than the connection timeout,
+            the connection timeout is used.
+        return_obj : `boolean`, optional
+            Return RPCReply objects instead of strings.
+
+        Returns
+        -------
+
+        list
+            The replies from the device, in the order of msgs.
+
+        Raises
+        ------
+
+        ValueError
+            If a message has no message-id, or two messages have the same
+            message-id.
+        TimeoutExpiredError
+            If not all replies are received before timeout.
+        '''
+
+        if timeout is None or timeout <= self.timeout:
             timeout = self.timeout
 
+        msgs = list(msgs)
+        msg_ids = list(map(_find_message_id, msgs))
+        if None in msg_ids:
+            raise ValueError('Pipelined rpc at index %d has no message-id'
+                             % msg_ids.index(None))
+        if len(msg_ids) != len(set(msg_ids)):
+            raise ValueError('Each pipelined rpc needs a distinct message-id')
+
+        rpcs = [self._raw_rpc(msg, timeout, async_mode=True) for msg in msgs]
+
+        # disable info logging for ncclient
+        nccl.setLevel(logging.WARNING)
+
+        try:
+            time1 = time.monotonic()
+            with self.session.batch():
+                for rpc, msg in zip(rpcs, msgs):
+                    rpc._request(msg)
+
+            deadline = time1 + timeout
+            replies = []
+            for rpc in rpcs:
+                rpc.event.wait(max(deadline - time.monotonic(), 0))
+                if not rpc.event.is_set():
+                    self.log.info('Timeout. No rpc-reply received.')
+                    raise TimeoutExpiredError('ncclient timed out while '
+                                              'waiting for an rpc-reply.')
+                if rpc.error:
+                    raise rpc.error
+                reply = rpc.reply
+                reply.elapsed = datetime.timedelta(
+                    seconds=time.monotonic() - time1)
+                self.log.info('Receiving rpc-reply after %.3f sec...',
+                              reply.elapsed.total_seconds())
+                self.log.info(reply)
+                replies.append(reply if return_obj else reply.xml)
+        finally:
+            # enable info logging for ncclient
+            nccl.setLevel(logging.INFO)
+
+        return replies
+
+    def _raw_rpc(self, msg, timeout, **kwargs):
+        '''Create a RawRPC for msg and register it under its message-id.'''
+
         rpc = RawRPC(session=self.session,
                      device_handler=self._device_handler,
                      timeout=timeout,
                      raise_mode=operations.rpc.RaiseMode.NONE,
-                     log=self.log)
+                     log=self.log,
+                     **kwargs)
 
         # identify message-id
-        m = re.search(r'message-id="([A-Za-z0-9_\-:# ]*)"', msg)
-        if m:
-            rpc._id = m.group(1)
+        msg_id = _find_message_id(msg)
+        if msg_id is not None:
+            rpc._id = msg_id
             rpc._listener.register(rpc._id, rpc)
             self.log.debug(
                 'Found message-id="%s" in your rpc, which is good.', rpc._id)
@@ -773,33 +1210,296 @@ class Netconf(manager.Manager, BaseConnection):
                            'expect an exception when receiving rpc-reply '
                            'due to missing message-id.')
 
-        # disable info logging for ncclient
-        nccl.setLevel(logging.WARNING)
-
-        if return_obj:
-            response = rpc._request(msg)
-        else:
-            response = rpc._request(msg).xml
-
-        # enable info logging for ncclient
-        nccl.setLevel(logging.INFO)
-
-        return response
+        return rpc
 
     def __getattr__(self, method):
         # avoid the __getattr__ from Manager class
-        if hasattr(manager, 'VENDOR_OPERATIONS') and method \
-                in manager.VENDOR_OPERATIONS or method in manager.OPERATIONS:
+        if method in self._operation_names:
             return super().__getattr__(method)
         else:
             raise AttributeError("'%s' object has no attribute '%s'"
                                  % (self.__class__.__name__, method))
 
 
+class NetconfPool():
+    '''NetconfPool
+
+    Keeps connected Netconf instances around for reuse. Jobs that open a
+    connection per task pay the SSH handshake and capability exchange only
+    once per device instead of every time.
+
+    Connections are keyed by the host, port and username they connect to,
+    so a device loaded again from the testbed, or another device object
+    pointing at the same target, gets the same session back. An idle
+    connection is closed when it has not been used for idle_timeout
+    seconds, and is not handed out again once it is older than max_age
+    seconds. Expired connections are closed when the pool is next used.
+
+    Code Example::
+
+        >>> from yang.connector.netconf import NetconfPool
+        >>> pool = NetconfPool()
+        >>> with pool.connection(device, via='netconf') as nc:
+        ...     reply = nc.request(netconf_request)
+        >>> pool.close()
+
+    NetconfPool.shared() returns a pool common to the whole process.
+    '''
+
+    _shared = None
+    _shared_lock = RLock()
+
+    def __init__(self, idle_timeout=None, max_age=None):
+        settings = Settings()
+        self.idle_timeout = idle_timeout if idle_timeout is not None \
+            else settings.NETCONF_POOL_IDLE_TIMEOUT
+        self.max_age = max_age if max_age is not None \
+            else settings.NETCONF_POOL_MAX_AGE
+        self._lock = RLock()
+        # (host, port, username) -> deque of [conn, created, last used]
+        self._idle = collections.defaultdict(collections.deque)
+        # conn -> (key, time it was connected)
+        self._owned = {}
+
+    @classmethod
+    def shared(cls):
+        '''Return the process wide pool, creating it on first use.'''
+
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    @staticmethod
+    def _key(device, via):
+        info = device.connections[via]
+        try:
+            username = info['credentials']['netconf']['username']
+        except (KeyError, TypeError):
+            username = info.get('username', info.get('user'))
+        return (str(info.get('host') or info.get('ip')),
+                int(info.get('port', 830)), username)
+
+    def acquire(self, device, via='netconf', **kwargs):
+        '''Return a connected Netconf instance for device, reusing an idle
+        one when possible. Extra keyword arguments are passed to Netconf
+        when a new connection is made.'''
+
+        key = self._key(device, via)
+        with self._lock:
+            self._evict()
+            idle = self._idle[key]
+            now = time.monotonic()
+            while idle:
+                conn, created, last_used = idle.pop()
+                # idle is ordered by last use, not by age, so _evict can
+                # leave connections past max_age behind newer ones
+                if conn.connected and \
+                        now - last_used < self.idle_timeout and \
+                        now - created < self.max_age:
+                    return conn
+                self._discard(conn)
+
+        kwargs.setdefault('alias', via)
+        conn = Netconf(device=device, via=via, **kwargs)
+        conn.connect()
+        with self._lock:
+            self._owned[conn] = (key, time.monotonic())
+        return conn
+
+    def release(self, conn):
+        '''Give a connection obtained from acquire back to the pool.'''
+
+        now = time.monotonic()
+        with self._lock:
+            try:
+                key, created = self._owned[conn]
+            except KeyError:
+                raise ValueError(
+                    'Connection does not belong to this pool') from None
+            if not conn.connected or now - created >= self.max_age:
+                self._discard(conn)
+            else:
+                self._idle[key].append([conn, created, now])
+            self._evict()
+
+    @contextlib.contextmanager
+    def connection(self, device, via='netconf', **kwargs):
+        '''Context manager around acquire and release.'''
+
+        conn = self.acquire(device, via=via, **kwargs)
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        '''Disconnect all idle connections.'''
+
+        with self._lock:
+            for idle in self._idle.values():
+                while idle:
+                    self._discard(idle.pop()[0])
+
+    def _evict(self):
+        now = time.monotonic()
+        for idle in self._idle.values():
+            # least recently used connections are on the left
+            while idle and (now - idle[0][2] >= self.idle_timeout or
+                            now - idle[0][1] >= self.max_age):
+                self._discard(idle.popleft()[0])
+
+    def _discard(self, conn):
+        self._owned.pop(conn, None)
+        try:
+            if conn.connected:
+                conn.disconnect()
+        except Exception as e:
+            logger.debug('Error closing pooled connection: %s', e)
+
+
+class ChunkedFramer():
+    """Incremental decoder for NETCONF 1.1 chunked framing (RFC 6242).
+
+    Bytes are fed as they arrive and complete messages are returned. The
+    parser keeps its position between calls, so every byte is looked at
+    once no matter how many reads a message is split over, and chunk data
+    is copied by length without being scanned for delimiters.
+    """
+
+    # RFC 6242 limits chunk-size to 4294967295
+    MAX_SIZE_DIGITS = 10
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.msg = bytearray()
+        self.chunk_left = 0
+
+    @staticmethod
+    def encode(data):
+        """Frame an encoded message as a single chunk."""
+        return b''.join((CHUNK_HEADER % len(data), data, CHUNK_END))
+
+    def feed(self, data):
+        """Add received bytes, return a list of completed messages."""
+        buf = self.buf
+        buf += data
+        messages = []
+        pos = 0
+        with memoryview(buf) as view:
+            while True:
+                if self.chunk_left:
+                    size = min(self.chunk_left, len(buf) - pos)
+                    self.msg += view[pos:pos + size]
+                    self.chunk_left -= size
+                    pos += size
+                    if self.chunk_left:
+                        break
+
+                # expecting a chunk header '\n#<size>\n' or end '\n##\n'
+                if len(buf) - pos < 4:
+                    break
+                if buf[pos:pos + 2] != b'\n#':
+                    # not framed (e.g. proxy stderr), skip to next header
+                    start = buf.find(b'\n#', pos + 1)
+                    logger.warning('Discarding unframed data: %r',
+                                   bytes(view[pos:start if start != -1
+                                              else len(buf)]))
+                    if start == -1:
+                        pos = len(buf)
+                        break
+                    pos = start
+                    continue
+                if buf[pos + 2] == ord('#'):
+                    if buf[pos + 3] != ord('\n'):
+                        raise ValueError('Invalid end-of-chunks marker')
+                    messages.append(bytes(self.msg))
+                    self.msg.clear()
+                    pos += 4
+                    continue
+
+                end = buf.find(b'\n', pos + 2, pos + 3 + self.MAX_SIZE_DIGITS)
+                if end == -1:
+                    if len(buf) - pos > 2 + self.MAX_SIZE_DIGITS:
+                        raise ValueError('Invalid chunk header %r'
+                                         % bytes(view[pos:pos + 16]))
+                    break
+                size = bytes(view[pos + 2:end])
+                if not size.isdigit() or size.startswith(b'0'):
+                    raise ValueError('Invalid chunk size %r' % size)
+                self.chunk_left = int(size)
+                pos = end + 1
+
+        del buf[:pos]
+        return messages
+
+
+class EomFramer():
+    """Incremental decoder for NETCONF 1.0 end-of-message framing.
+
+    The search for the marker resumes where the previous one stopped, so a
+    large reply arriving in many reads is scanned once, not once per read.
+    """
+
+    EOM = EOM_DELIM
+
+    def __init__(self):
+        self.buf = bytearray()
+        # offset in buf from which the marker has not been looked for
+        self.scan = 0
+
+    @staticmethod
+    def encode(data):
+        """Terminate an encoded message with the end-of-message marker."""
+        return data + EOM_DELIM
+
+    def feed(self, data):
+        """Add received bytes, return a list of completed messages."""
+        buf = self.buf
+        buf += data
+        messages = []
+        pos = 0
+        while True:
+            end = buf.find(self.EOM, max(pos, self.scan))
+            if end == -1:
+                break
+            messages.append(bytes(buf[pos:end]).strip())
+            pos = end + len(self.EOM)
+
+        del buf[:pos]
+        # the marker may be split over reads, rescan its possible start
+        self.scan = max(len(buf) - len(self.EOM) + 1, 0)
+        return messages
+
+
+class FramedParser():
+    """Parser for SSHSession, used in place of ncclient's DefaultXMLParser.
+
+    Received bytes are split into messages by EomFramer until the hello
+    exchange settles on base:1.1, then by ChunkedFramer. Each message is
+    decoded as a whole, so a multi-byte character split between reads is
+    not an error, and large replies are not re-scanned on every read.
+    """
+
+    def __init__(self, session):
+        self._session = session
+        self._framer = EomFramer()
+
+    def parse(self, data):
+        framer = self._framer
+        if self._session._base == NetconfBase.BASE_11 and \
+                isinstance(framer, EomFramer):
+            # hello is done, carry over anything read past it
+            self._framer = ChunkedFramer()
+            messages = self._framer.feed(bytes(framer.buf) + data)
+        else:
+            messages = framer.feed(data)
+        for msg in messages:
+            self._session._dispatch_message(msg.decode('utf-8'))
+
+
 class NetconfEnxr():
     """Subclass using POSIX pipes to Communicate NETCONF messaging."""
-
-    chunk = re.compile('(\n#+\\d+\n)')
     rpc_pipe_err = """
         <rpc-reply xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">
         <rpc-error>
@@ -810,10 +1510,14 @@ class NetconfEnxr():
         </rpc-error>
         </rpc-reply>"""
 
+    # maximum number of bytes taken from the pipe per read
+    bufsize = 65536
+
     def __init__(self, *args, **kwargs):
         self.manager = None
         self.proc = None
-        self.buf = None
+        self.framer = None
+        self.replies = collections.deque()
         self.server_capabilities = None
 
     def get_rpc(self, elements):
@@ -827,29 +1531,32 @@ class NetconfEnxr():
         return et.tostring(rpc_element,
                            pretty_print=True).decode()
 
+    def _read(self):
+        """Block until the pipe has data and return what is available.
+
+        os.read returns as soon as anything is readable (up to bufsize
+        bytes), so unlike a buffered read of a fixed size it cannot block
+        waiting for data the proxy will never send.
+        """
+        return os.read(self.proc.stdout.fileno(), self.bufsize)
+
     def recv_data(self):
         """Retrieve data from process pipe."""
         if not self.proc:
             logger.info('Not connected.')
         else:
-            buf = ''
-            while True:
-                # TODO: Could be better...1 byte at a time...
-                # but, too much buffer and it deadlocks!!
-                data = self.proc.stdout.read(1)
+            while not self.replies:
+                data = self._read()
 
                 if not data:
                     return GetReply(self.rpc_pipe_err)
 
-                buf += data
+                self.replies.extend(self.framer.feed(data))
 
-                if buf.endswith('\n##'):
-                    buf = buf[:-3]
-                    break
+            # messages are only decoded once complete
+            reply = self.replies.popleft().decode('utf-8')
 
-            logger.info(buf)
-            buf = buf[buf.find('<'):]
-            reply = re.sub(self.chunk, '', buf)
+            logger.info(reply)
             return GetReply(reply)
 
     def request(self, rpc):
@@ -884,23 +1591,39 @@ class NetconfEnxr():
                         'invalid netconf requst as negative test cases, in '
                         'XML format and send it by method request.')
 
+    def _frame(self, rpc):
+        """Return rpc, a string or an element, framed for the pipe."""
+        if et.iselement(rpc):
+            if not rpc.tag.endswith('rpc'):
+                rpc = self.get_rpc(rpc)
+            else:
+                rpc = et.tostring(rpc, pretty_print=True).decode()
+        logger.info(rpc)
+        # chunk-size counts octets, so frame the encoded rpc
+        return self.framer.encode(rpc.encode('utf-8'))
+
     def send_cmd(self, rpc):
         """Send a message to process pipe."""
         if not self.proc:
             logger.info('Not connected.')
         else:
-            if et.iselement(rpc):
-                if not rpc.tag.endswith('rpc'):
-                    rpc = self.get_rpc(rpc)
-                else:
-                    rpc = et.tostring(rpc, pretty_print=True).decode()
-            rpc_str = '\n#' + str(len(rpc)) + '\n' + rpc + '\n##\n'
-            logger.info(rpc_str)
-            self.proc.stdin.write(rpc_str)
+            self.proc.stdin.write(self._frame(rpc))
             self.proc.stdin.flush()
 
             return self.recv_data()
 
+    def request_many(self, rpcs):
+        """Send several messages to process pipe in one write, then
+        collect their replies, which come back in the same order."""
+        if not self.proc:
+            logger.info('Not connected.')
+        else:
+            rpcs = list(rpcs)
+            self.proc.stdin.write(b''.join(map(self._frame, rpcs)))
+            self.proc.stdin.flush()
+
+            return [self.recv_data() for _ in rpcs]
+
     def edit_config(self, target=None, config=None, **kwargs):
         """Send edit-config."""
         target = target
@@ -989,8 +1712,8 @@ class NetconfEnxr():
     def connected(self):
         """Check for active connection."""
 
-        return self.server_capabilities is not None and self.proc.poll() \
-            is None
+        return self.server_capabilities is not None and \
+            self.proc is not None and self.proc.poll() is None
 
     def connect(self, timeout=None):
         """Connect to ENXR pipe."""
@@ -998,47 +1721,65 @@ class NetconfEnxr():
             msg = 'Already connected'
 
         CMD = ['netconf_sshd_proxy', '-i', '0', '-o', '1', '-u', 'lab']
-        BUFSIZE = 8192
 
-        p = subprocess.Popen(CMD, bufsize=BUFSIZE,
+        p = subprocess.Popen(CMD, bufsize=self.bufsize,
                              stdin=subprocess.PIPE,
                              stdout=subprocess.PIPE,
-                             stderr=subprocess.STDOUT,
-                             universal_newlines=True)
+                             stderr=subprocess.STDOUT)
 
-        buf = ''
+        buf = bytearray()
         try:
+            self.proc = p
             while True:
-                data = p.stdout.read(1)
+                end = buf.find(EOM_DELIM)
+                if end != -1:
+                    # chunked framing is used from here on if both sides
+                    # support base:1.1 (we always do)
+                    if b'urn:ietf:params:netconf:base:1.1' in buf[:end]:
+                        self.framer = ChunkedFramer()
+                    else:
+                        self.framer = EomFramer()
+                    self.replies.clear()
+                    self.replies.extend(
+                        self.framer.feed(buf[end + len(EOM_DELIM):]))
+                    buf = bytes(buf[buf.find(b'<'):end])
+                    logger.info('Hello received')
+                    break
+
+                data = self._read()
                 if not data:
                     logger.info('No data received for hello')
-                    p.terminate()
+                    self._connect_failed(p)
                     return
 
                 buf += data
-                if buf.endswith(']]>]]>'):
-                    buf = buf[buf.find('<'):-6]
-                    logger.info('Hello received')
-                    break
 
             p.stdin.write(
-                '<?xml version="1.0" encoding="UTF-8"?><hello '
-                'xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><capabilities>'
-                '<capability>urn:ietf:params:netconf:base:1.1</capability>'
-                '</capabilities></hello>]]>]]>'
+                b'<?xml version="1.0" encoding="UTF-8"?><hello '
+                b'xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><capabilities>'
+                b'<capability>urn:ietf:params:netconf:base:1.0</capability>'
+                b'<capability>urn:ietf:params:netconf:base:1.1</capability>'
+                b'</capabilities></hello>]]>]]>'
             )
             p.stdin.flush()
-            self.proc = p
-            self.buf = ''
             elements = et.fromstring(buf)
             self.server_capabilities = [e.text for e in elements.iter()
                                         if hasattr(e, 'text')]
             # TODO: Notification stream interferes with get-schema
             msg = "NETCONF CONNECTED PIPE"
-        except:
+        except Exception:
+            self._connect_failed(p)
             msg = 'Not connected, Something went wrong'
         return msg
 
+    def _connect_failed(self, p):
+        """Forget the session state and stop the proxy process."""
+        self.proc = None
+        self.framer = None
+        self.server_capabilities = None
+        p.terminate()
+        p.wait()
+
     def disconnect(self):
         """Disconnect from ENXR pipe."""
         if self.connected:
@@ -1055,8 +1796,21 @@ class RawRPC(operations.rpc.RPC):
 
     def __init__(self, *args, **kwargs):
         self.log = kwargs.pop('log', logging.getLogger(__name__))
+        # optional callable invoked with this rpc once a reply or an error
+        # has been delivered by the session thread
+        self._done = kwargs.pop('done', None)
         super().__init__(*args, **kwargs)
 
+    def deliver_reply(self, raw):
+        super().deliver_reply(raw)
+        if self._done:
+            self._done(self)
+
+    def deliver_error(self, err):
+        super().deliver_error(err)
+        if self._done:
+            self._done(self)
+
     def _request(self, msg):
         '''_request
 
@@ -1068,26 +1822,27 @@ class RawRPC(operations.rpc.RPC):
         rpc request, ncclient will raise an OperationError.
         '''
 
-        self.log.debug('Requesting %r' % self.__class__.__name__)
+        self.log.debug('Requesting %r', self.__class__.__name__)
         self.log.info('Sending rpc...')
         self.log.info(msg)
-        time1 = datetime.datetime.now()
+        time1 = time.monotonic()
         self._session.send(msg)
         if not self._async:
-            self.log.debug('Sync request, will wait for timeout=%r' %
-                         self._timeout)
+            self.log.debug('Sync request, will wait for timeout=%r',
+                           self._timeout)
             self._event.wait(self._timeout)
             if self._event.isSet():
-                time2 = datetime.datetime.now()
-                self._reply.elapsed = time2 - time1
-                self.log.info('Receiving rpc-reply after {:.3f} sec...'.
-                            format(self._reply.elapsed.total_seconds()))
+                self._reply.elapsed = datetime.timedelta(
+                    seconds=time.monotonic() - time1)
+                self.log.info('Receiving rpc-reply after %.3f sec...',
+                              self._reply.elapsed.total_seconds())
                 self.log.info(self._reply)
                 return self._reply
             else:
                 self.log.info('Timeout. No rpc-reply received.')
                 raise TimeoutExpiredError('ncclient timed out while waiting '
                                           'for an rpc-reply.')
+        return self
 
 
 class Notification(Thread):
@@ -1098,10 +1853,27 @@ class Notification(Thread):
         self.log = logging.getLogger(__name__)
         self.log.setLevel(logging.DEBUG)
         self._stop_event = Event()
+        self._result_event = Event()
         self.request = request
         self._event_triggered = False
         self._stopped = False
 
+    @property
+    def result(self):
+        return self._result
+
+    @result.setter
+    def result(self, result):
+        self._result = result
+        if result is None:
+            self._result_event.clear()
+        else:
+            self._result_event.set()
+
+    def wait_for_result(self, timeout=None):
+        """ Block until a result is set; False if timeout expires first """
+        return self._result_event.wait(timeout)
+
     @property
     def event_triggered(self):
         return self._event_triggered
@@ -1115,7 +1887,7 @@ class Notification(Thread):
         return self._request
 
     @request.setter
-    def request(self, request={}):
+    def request(self, request):
         """ Sets the request property and propagates request's properties to the class """
         request_data = request['request']
         self.returns = request_data.get('returns')
@@ -1135,26 +1907,19 @@ class Notification(Thread):
 
     def run(self):
         """ Start taking notifications until subscribe stream times out."""
-        t1 = datetime.datetime.now()
-        t2 = datetime.datetime.now()
-        td = t2 - t1
+        t1 = time.monotonic()
         # Wait until after first sample period if sampling
         wait_for_sample = self.sample_interval - 1
 
         try:
             while self.time_delta < self.stream_max:
-                t2 = datetime.datetime.now()
-                td = t2 - t1
-
                 if self.stopped():
                     self.time_delta = self.stream_max
                     self.log.info("Terminating notification thread")
                     break
                 if self.stream_max:
-                    t2 = datetime.datetime.now()
-                    td = t2 - t1
-                    self.time_delta = td.seconds
-                    if td.seconds > self.stream_max:
+                    self.time_delta = int(time.monotonic() - t1)
+                    if self.time_delta > self.stream_max:
                         self.stop()
                         break
 
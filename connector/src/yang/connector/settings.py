@@ -8,7 +8,22 @@ class Settings(dict):
         self.NETCONF_SCREEN_LOGGING_MAX_LINES = 40
         # Enable XML formatting by default
         self.NETCONF_LOGGING_FORMAT_XML = True
+        # Default SSH channel window size
+        self.NETCONF_SSH_WINDOW_SIZE = 2**27
+        # Default SSH channel max packet size
+        self.NETCONF_SSH_MAX_PACKET_SIZE = 2**15
+        # Seconds an idle pooled Netconf connection is kept open
+        self.NETCONF_POOL_IDLE_TIMEOUT = 300
+        # Seconds after which a pooled Netconf connection is not reused
+        self.NETCONF_POOL_MAX_AGE = 3600
         # Default receive message length
         self.GRPC_MAX_RECEIVE_MESSAGE_LENGTH = 1000000000
         # Default send message length
         self.GRPC_MAX_SEND_MESSAGE_LENGTH = 1000000000
+        # Milliseconds between gRPC keepalive pings, None to not send any
+        self.GRPC_KEEPALIVE_TIME_MS = None
+        # Log messages kept in Gnmi.results, None to keep all of them
+        self.GNMI_RESULTS_MAXLEN = 10000
+        # Share one gRPC channel between Gnmi connections to the same
+        # target with the same credentials and options
+        self.GRPC_SHARE_CHANNELS = False
@@ -1,6 +1,11 @@
+import os
+import tempfile
+import threading
 import unittest
 from unittest.mock import Mock, MagicMock, patch
 
+from google.protobuf import json_format
+
 from yang.connector import proto
 from yang.connector import gnmi
 from yang.connector import xpath_util
@@ -33,6 +38,175 @@ class TestGnmi(unittest.TestCase):
             device.connect(alias='gnmi', via='Gnmi')
             mock_grpc.assert_called_with('1.2.3.4:830', [('grpc.max_receive_message_length', 1000000000), ('grpc.max_send_message_length', 1000000000)])
 
+    def test_disconnect_stops_notification(self):
+
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "1.2.3.4"\n' \
+            '                port: 830\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel'):
+            device.connect(alias='gnmi', via='Gnmi')
+        notifier = Mock()
+        device.gnmi.active_notifications[device.gnmi] = notifier
+        device.gnmi.disconnect()
+        notifier.stop.assert_called_once()
+        self.assertEqual(device.gnmi.active_notifications, {})
+
+    def test_connect_credentials(self):
+
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        credentials:\n' \
+            '            default:\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+            '            gnmi:\n' \
+            '                username: gnmi_user\n' \
+            '                password: gnmi_pass\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "1.2.3.4"\n' \
+            '                port: 830\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel'):
+            device.connect(alias='gnmi', via='Gnmi')
+        self.assertEqual(device.gnmi.metadata,
+                         [('username', 'gnmi_user'), ('password', 'gnmi_pass')])
+
+    def test_results(self):
+
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "1.2.3.4"\n' \
+            '                port: 830\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+            '                settings:\n' \
+            '                  GNMI_RESULTS_MAXLEN: 2\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel'):
+            device.connect(alias='gnmi', via='Gnmi')
+            device.gnmi.connect()
+        handlers = [h for h in gnmi.log.handlers
+                    if isinstance(h, gnmi.GnmiLogHandler)
+                    and h.gnmi_session is device.gnmi]
+        self.assertEqual(len(handlers), 1)
+        for msg in ('one', 'two', 'three'):
+            gnmi.log.info(msg)
+        self.assertEqual(list(device.gnmi.results), ['two', 'three'])
+        device.gnmi.disconnect()
+        self.assertNotIn(handlers[0], gnmi.log.handlers)
+
+    def test_shared_channel(self):
+
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "1.2.3.5"\n' \
+            '                port: 830\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+            '                settings:\n' \
+            '                  GRPC_SHARE_CHANNELS: True\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel') as mock_grpc:
+            device.connect(alias='gnmi', via='Gnmi')
+            # settings are popped from connection info on connect
+            device.connections['Gnmi']['settings'] = \
+                {'GRPC_SHARE_CHANNELS': True}
+            device.connect(alias='gnmi2', via='Gnmi')
+        mock_grpc.assert_called_once()
+        channel = mock_grpc.return_value
+        self.assertIs(device.gnmi.channel, channel)
+        self.assertIs(device.gnmi2.channel, channel)
+        device.gnmi.disconnect()
+        channel.close.assert_not_called()
+        device.gnmi2.disconnect()
+        channel.close.assert_called_once()
+        self.assertEqual(gnmi._shared_channels, {})
+
+    def test_shared_channel_connect_error(self):
+
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "1.2.3.6"\n' \
+            '                port: 830\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+            '                settings:\n' \
+            '                  GRPC_SHARE_CHANNELS: True\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel') as mock_grpc, \
+                patch('yang.connector.gnmi.proto.gnmi_pb2_grpc.gNMIStub') \
+                as mock_stub:
+            mock_stub.return_value.Capabilities.side_effect = \
+                Exception('unreachable')
+            with self.assertRaises(Exception):
+                device.connect(alias='gnmi', via='Gnmi')
+        mock_grpc.return_value.close.assert_called_once()
+        self.assertEqual(gnmi._shared_channels, {})
+
+    def test_connect_ipv6(self):
+
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "2001:db8::1"\n' \
+            '                port: 830\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel') as mock_grpc:
+            device.connect(alias='gnmi', via='Gnmi')
+            mock_grpc.assert_called_with('[2001:db8::1]:830', [('grpc.max_receive_message_length', 1000000000), ('grpc.max_send_message_length', 1000000000)])
+
     def test_re_connect(self):
 
         yaml = \
@@ -154,6 +328,102 @@ class TestGnmi(unittest.TestCase):
         )
         self.assertEqual(origin, 'openconfig')
 
+    def test_xpath_to_path_elem_prefixes(self):
+        request = {
+            'namespace': {
+                'ios': 'http://cisco.com/ns/yang/Cisco-IOS-XE-native',
+                'oc-if': 'http://openconfig.net/yang/interfaces',
+                'ianaift': 'urn:ietf:params:xml:ns:yang:iana-if-type',
+            },
+            'nodes': [
+                {'xpath': '/ios:native/ios:hostname',
+                 'value': 'ios:R1', 'edit-op': 'merge'},
+                {'xpath': '/oc-if:interfaces/oc-if:interface/oc-if:type',
+                 'value': 'ianaift:ethernetCsmacd', 'edit-op': 'merge'},
+            ],
+        }
+        modules, message, origin = xpath_util.xml_path_to_path_elem(request)
+        self.assertEqual(
+            message['update'],
+            [{'/Cisco-IOS-XE-native:native': {
+                'Cisco-IOS-XE-native:hostname': 'Cisco-IOS-XE-native:R1'}},
+             {'/interfaces/interface': {'type': 'ianaift:ethernetCsmacd'}}]
+        )
+        self.assertEqual(origin, 'openconfig')
+
+    def test_xpath_to_path_elem_delete(self):
+        request = {
+            'namespace': {'oc-sys': 'http://openconfig.net/yang/system'},
+            'nodes': [
+                {'xpath': '/oc-sys:system/oc-sys:config/oc-sys:hostname',
+                 'edit-op': 'delete'},
+                {'xpath': '/oc-sys:system/oc-sys:config/oc-sys:domain-name',
+                 'edit-op': 'remove'},
+            ],
+        }
+        modules, message, origin = xpath_util.xml_path_to_path_elem(request)
+        self.assertEqual(message['delete'], ['/system/config/hostname',
+                                             '/system/config/domain-name'])
+        self.assertEqual(message['update'], [])
+
+    def test_path_to_xpath(self):
+        prefix = proto.gnmi_pb2.Path()
+        prefix.elem.add(name='interfaces')
+        path = proto.gnmi_pb2.Path()
+        elem = path.elem.add(name='interface')
+        elem.key['name'] = 'Gi1'
+        elem.key['area'] = '0'
+        path.elem.add(name='mtu')
+        self.assertEqual(xpath_util.path_to_xpath(path),
+                         '/interface[area="0"][name="Gi1"]/mtu')
+        self.assertEqual(xpath_util.path_to_xpath(path, prefix),
+                         '/interfaces/interface[area="0"][name="Gi1"]/mtu')
+        self.assertEqual(xpath_util.path_to_xpath(proto.gnmi_pb2.Path()), '/')
+
+    def test_xpath_to_json_default_payload(self):
+        payload = xpath_util.xpath_to_json([])
+        payload['leaked'] = True
+        self.assertEqual(xpath_util.xpath_to_json([]), {})
+        self.assertEqual(
+            xpath_util.xpath_to_json([('/system/config', {'hostname': 'R1'},
+                                       False)]),
+            {'config': {'hostname': 'R1'}}
+        )
+
+    def test_load_certificate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'root.pem')
+            with open(filename, 'wb') as f:
+                f.write(b'ROOT')
+            self.assertEqual(gnmi._load_certificate(filename), b'ROOT')
+            self.assertIs(gnmi._load_certificate(filename),
+                          gnmi._load_certificate(filename))
+            with open(filename, 'wb') as f:
+                f.write(b'ROTATED')
+            os.utime(filename, ns=(0, 0))
+            self.assertEqual(gnmi._load_certificate(filename), b'ROTATED')
+        self.assertIsNone(gnmi._load_certificate(''))
+        self.assertEqual(gnmi._load_certificate('-----BEGIN'), '-----BEGIN')
+        pem = '-----BEGIN CERTIFICATE-----\n' + 'A' * 5000
+        self.assertEqual(gnmi._load_certificate(pem), pem)
+        self.assertEqual(gnmi._load_certificate(tempfile.gettempdir()),
+                         tempfile.gettempdir())
+
+    def test_xpath_to_json_many_configs(self):
+        configs = [('/system/config', {'leaf{0}'.format(i): i}, True)
+                   for i in range(5000)]
+        payload = xpath_util.xpath_to_json(configs)
+        self.assertEqual(len(payload['config']), 5000)
+
+    def test_common_xpath_prefix(self):
+        prefix = xpath_util.common_xpath_prefix
+        self.assertEqual(prefix(['/a/bar', '/a/baz']), '/a')
+        self.assertEqual(prefix(['/a/b', '/a/b/c']), '/a/b')
+        self.assertEqual(prefix(['/a/b', '/a/b[k="1"]/c']), '/a/b')
+        self.assertEqual(prefix(['/i/if[name="Gi0/0/1"]/c',
+                                 '/i/if[name="Gi0/1/1"]/c']), '/i/if')
+        self.assertEqual(prefix(['/x', '/y']), '')
+
     def test_get_prefix(self):
         """Test creating a prefix Path gNMI class."""
         path = xpath_util.get_prefix('rfc7951')
@@ -182,6 +452,204 @@ class TestGnmi(unittest.TestCase):
             device.connect(alias='gnmi', via='Gnmi')
             mock_grpc.assert_called_with('1.2.3.4:830', [('grpc.max_receive_message_length', 100), ('grpc.max_send_message_length', 100)])
 
+    def test_decode_typed_value(self):
+        val = proto.gnmi_pb2.TypedValue()
+        self.assertIsNone(gnmi.decode_typed_value(val))
+        val.uint_val = 10
+        self.assertEqual(gnmi.decode_typed_value(val), 10)
+        val.string_val = 'R1'
+        self.assertEqual(gnmi.decode_typed_value(val), 'R1')
+        val.json_ietf_val = b'{"name": "R1"}'
+        self.assertEqual(gnmi.decode_typed_value(val), {'name': 'R1'})
+        val.decimal_val.digits = 1234
+        val.decimal_val.precision = 2
+        self.assertEqual(str(gnmi.decode_typed_value(val)), '12.34')
+        val.leaflist_val.element.add().bool_val = True
+        val.leaflist_val.element.add().int_val = -1
+        self.assertEqual(gnmi.decode_typed_value(val), [True, -1])
+
+    def test_notification_run_log_disabled(self):
+        response = MagicMock()
+        response.WhichOneof.return_value = 'update'
+        notifier = gnmi.GnmiNotification(None, [response], format={})
+        notifier.log = Mock()
+        notifier.log.isEnabledFor.return_value = False
+        with patch.object(notifier, 'process_opfields') as process:
+            notifier.run()
+        process.assert_called_once_with(response)
+        response.__str__.assert_not_called()
+
+    def test_notification_run_dispatch(self):
+        sync = proto.gnmi_pb2.SubscribeResponse(sync_response=True)
+        update = proto.gnmi_pb2.SubscribeResponse()
+        update.update.update.add().val.int_val = 1
+        notifier = gnmi.GnmiNotification(None, [sync, update], format={})
+        with patch.object(notifier, 'process_opfields') as process:
+            notifier.run()
+        process.assert_called_once_with(update)
+
+    def test_notification_run_stream_error(self):
+        def responses():
+            yield proto.gnmi_pb2.SubscribeResponse(sync_response=True)
+            raise ValueError('stream reset')
+        notifier = gnmi.GnmiNotification(None, responses(), format={})
+        notifier.run()
+        self.assertEqual(notifier.result, 'stream reset')
+
+    def test_notification_stop_idle_stream(self):
+        idle = threading.Event()
+        def responses():
+            idle.wait(10)
+            return
+            yield
+        notifier = gnmi.GnmiNotification(None, responses(), format={})
+        notifier.start()
+        notifier.stop()
+        notifier.join(5)
+        idle.set()
+        self.assertFalse(notifier.is_alive())
+        self.assertIsNone(notifier.result)
+
+    def test_notification_stop_cancels_stream(self):
+        class Stream:
+            # blocks like a grpc stream until the call is cancelled
+            def __init__(self):
+                self.cancelled = threading.Event()
+
+            def __iter__(self):
+                return self
+
+            def __next__(self):
+                self.cancelled.wait(10)
+                raise Exception('cancelled')
+
+            def cancel(self):
+                self.cancelled.set()
+
+        stream = Stream()
+        notifier = gnmi.GnmiNotification(None, stream, format={})
+        notifier.start()
+        notifier.stop()
+        notifier.join(5)
+        self.assertFalse(notifier.is_alive())
+        self.assertTrue(stream.cancelled.is_set())
+        self.assertFalse(notifier._reader.is_alive())
+        self.assertIsNone(notifier.result)
+
+    def test_connect_grpc_options(self):
+        yaml = \
+            'devices:\n' \
+            '    dummy:\n' \
+            '        type: dummy_device\n' \
+            '        connections:\n' \
+            '            Gnmi:\n' \
+            '                class:  yang.connector.Gnmi\n' \
+            '                protocol: gnmi\n' \
+            '                ip : "1.2.3.4"\n' \
+            '                port: 830\n' \
+            '                username: admin\n' \
+            '                password: admin\n' \
+            '                grpc_options:\n' \
+            '                  grpc.http2.write_buffer_size: 0\n' \
+            '                settings:\n' \
+            '                  GRPC_KEEPALIVE_TIME_MS: 30000\n' \
+
+        testbed = loader.load(yaml)
+        device = testbed.devices['dummy']
+        with patch('yang.connector.gnmi.grpc.insecure_channel') as mock_grpc:
+            device.connect(alias='gnmi', via='Gnmi')
+            mock_grpc.assert_called_once_with('1.2.3.4:830', [
+                ('grpc.max_receive_message_length', 1000000000),
+                ('grpc.max_send_message_length', 1000000000),
+                ('grpc.keepalive_time_ms', 30000),
+                ('grpc.http2.write_buffer_size', 0)])
+
+    def test_notification_process_opfields(self):
+        response = proto.gnmi_pb2.SubscribeResponse()
+        update = response.update.update.add()
+        update.path.elem.add(name='system')
+        update.val.json_ietf_val = b'{"name": "R1"}'
+        request = {
+            'format': {},
+            'decode': Mock(return_value=[{'value': 'R1'}]),
+            'verifier': Mock(return_value=True),
+            'returns': [{'value': 'R1'}],
+            'namespace': {},
+        }
+        notifier = gnmi.GnmiNotification(None, [], **request)
+        notifier.event_triggered = True
+        notifier.process_opfields(response)
+        request['decode'].assert_called_once_with(
+            {'path': {'elem': [{'name': 'system'}]},
+             'val': {'jsonIetfVal': 'eyJuYW1lIjogIlIxIn0='}}, {})
+        self.assertTrue(notifier.result)
+
+        # a notification with only deletes has nothing to decode
+        response = proto.gnmi_pb2.SubscribeResponse()
+        response.update.delete.add().elem.add(name='system')
+        notifier.process_opfields(response)
+        request['decode'].assert_called_once()
+
+    def test_update_to_dict(self):
+        update = proto.gnmi_pb2.Update()
+        update.path.origin = 'openconfig'
+        update.path.elem.add(name='interfaces')
+        update.path.elem.add(name='interface').key['name'] = 'Gi0/0/1'
+        for field, value in (('json_ietf_val', b'{"mtu": 1500}'),
+                             ('int_val', -2**63), ('uint_val', 2**64 - 1),
+                             ('bool_val', False), ('string_val', 'up'),
+                             ('double_val', 0.1)):
+            setattr(update.val, field, value)
+            self.assertEqual(gnmi._update_to_dict(update),
+                             json_format.MessageToDict(update))
+        self.assertEqual(gnmi._update_to_dict(proto.gnmi_pb2.Update()), {})
+
+    def test_notification_wait_for_result(self):
+        notifier = gnmi.GnmiNotification(None, [], format={})
+        self.assertFalse(notifier.wait_for_result(0))
+        threading.Timer(0.1, setattr, (notifier, 'result', True)).start()
+        self.assertTrue(notifier.wait_for_result(10))
+        self.assertIs(notifier.result, True)
+        notifier.request = {'format': {}}
+        self.assertIsNone(notifier.result)
+        self.assertFalse(notifier.wait_for_result(0))
+
+    def test_notification_no_returns(self):
+        response = proto.gnmi_pb2.SubscribeResponse()
+        response.update.update.add().val.int_val = 1
+        response.update.update.add().val.int_val = 2
+        decode = Mock(return_value=[{'value': 1}])
+        notifier = gnmi.GnmiNotification(None, [], format={}, decode=decode,
+                                         namespace={})
+        notifier.event_triggered = True
+        notifier.process_opfields(response)
+        decode.assert_called_once()
+        self.assertIs(notifier.result, False)
+        self.assertTrue(notifier.stopped())
+
+    def test_notification_stopped(self):
+        response = proto.gnmi_pb2.SubscribeResponse()
+        response.update.update.add().val.int_val = 1
+        response.update.update.add().val.int_val = 2
+        decode = Mock(return_value=[{'value': 1}])
+        notifier = gnmi.GnmiNotification(None, [], format={}, decode=decode,
+                                         namespace={})
+        notifier.stop()
+        notifier.process_opfields(response)
+        decode.assert_not_called()
+
+    def test_notification_decode_proto(self):
+        response = proto.gnmi_pb2.SubscribeResponse()
+        update = response.update.update.add()
+        update.val.json_ietf_val = b'{"name": "R1"}'
+        decode = Mock(return_value=None)
+        notifier = gnmi.GnmiNotification(None, [], format={}, decode=decode,
+                                         decode_proto=True, namespace={})
+        notifier.process_opfields(response)
+        decode.assert_called_once_with(update, {})
+        self.assertEqual(decode.call_args[0][0].val.json_ietf_val,
+                         b'{"name": "R1"}')
+
 
 if __name__ == '__main__':
     unittest.main()
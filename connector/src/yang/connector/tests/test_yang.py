@@ -1,10 +1,21 @@
 #!/bin/env python
 """ Unit tests for the yang.connector cisco-shared package. """
 
+import os
+import sys
+import socket
+import asyncio
+import inspect
+import contextlib
 import unittest
+import tempfile
+import threading
+import subprocess
+import paramiko
 from ncclient import manager
 from ncclient import transport
 from ncclient.devices.default import DefaultDeviceHandler
+from ncclient.transport.session import NetconfBase
 from pyats.topology import loader
 from pyats.connections import BaseConnection
 from unittest.mock import Mock, patch
@@ -81,6 +92,32 @@ class MySSHSession2():
     def is_alive(self):
         return True
 
+class MyReplySSHSession(MySSHSession):
+    """Delivers a canned rpc-reply from another thread, like ncclient."""
+
+    reply = '''<rpc-reply message-id="101"
+        xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><ok/></rpc-reply>'''
+
+    def __init__(self):
+        super().__init__()
+        self.listeners = []
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def send(self, message):
+        msg_id = message.split('message-id="')[1].split('"')[0]
+        def deliver():
+            for listener in self.listeners:
+                rpc = listener._id2rpc.get(msg_id)
+                if rpc:
+                    rpc.deliver_reply(self.reply.replace('101', msg_id))
+        threading.Timer(0.01, deliver).start()
+
+    @contextlib.contextmanager
+    def batch(self):
+        yield
+
 class MyRawRPC():
 
     def __init__(self, session=None, device_handler=None,
@@ -159,6 +196,30 @@ class TestYang(unittest.TestCase):
         expected_value = False
         self.assertEqual(generated_value, expected_value)
 
+    def test_disconnect_stops_notification(self):
+        self.nc_device._session = MySSHSession()
+        self.nc_device.connect()
+        notifier = Mock()
+        self.nc_device.active_notifications[self.nc_device] = notifier
+        self.nc_device.disconnect()
+        notifier.stop.assert_called_once()
+        self.assertEqual(self.nc_device.active_notifications, {})
+
+    def test_connect_missing_host(self):
+        self.nc_device._session = MySSHSession()
+        del self.nc_device.connection_info['ip']
+        with self.assertRaises(KeyError):
+            self.nc_device.connect()
+        self.assertFalse(self.nc_device.connected)
+
+    def test_live_sessions(self):
+        self.nc_device._session = MySSHSession()
+        self.nc_device.connect()
+        self.assertIn(self.nc_device, yang.connector.netconf._live_sessions)
+        self.nc_device.disconnect()
+        self.assertNotIn(self.nc_device,
+                         yang.connector.netconf._live_sessions)
+
     def test_connect_1(self):
         self.nc_device._session = MySSHSession()
         self.nc_device.connect()
@@ -197,6 +258,54 @@ class TestYang(unittest.TestCase):
         expected_value = False
         self.assertEqual(generated_value, expected_value)
 
+    def test_notify_wait(self):
+        self.nc_device._session = MySSHSession()
+        self.nc_device.connect()
+        request = {'format': {'sample_interval': 0, 'stream_max': 30}}
+        notifier = yang.connector.netconf.Notification(self.nc_device,
+                                                       request=request)
+        self.nc_device.active_notifications[self.nc_device] = notifier
+        steps = Mock()
+        steps.result.code = 1
+        threading.Timer(0.1, setattr, (notifier, 'result', True)).start()
+        self.nc_device.notify_wait(steps)
+        steps.passed.assert_called_once()
+        self.assertTrue(notifier.stopped())
+        self.assertNotIn(self.nc_device, self.nc_device.active_notifications)
+
+    def test_notify_wait_timeout(self):
+        self.nc_device._session = MySSHSession()
+        self.nc_device.connect()
+        request = {'format': {'sample_interval': 0, 'stream_max': 1}}
+        notifier = yang.connector.netconf.Notification(self.nc_device,
+                                                       request=request)
+        self.assertFalse(notifier.wait_for_result(0))
+        self.nc_device.active_notifications[self.nc_device] = notifier
+        steps = Mock()
+        steps.result.code = 1
+        self.nc_device.notify_wait(steps)
+        steps.failed.assert_called_once()
+        steps.passed.assert_not_called()
+
+    def test_find_message_id(self):
+        find = yang.connector.netconf._find_message_id
+        self.assertEqual(find('<rpc message-id="urn:uuid:1.2" a="b"/>'),
+                         'urn:uuid:1.2')
+        self.assertIsNone(find('<rpc/>'))
+        self.assertIsNone(find('<rpc message-id="101'))
+        self.assertEqual(find(b'<rpc message-id="101"/>'), '101')
+
+    def test_request_timeout(self):
+        self.nc_device.timeout = 60
+        with patch.object(self.nc_device, '_raw_rpc',
+                          return_value=MyRawRPC()) as mock_rpc:
+            self.nc_device.request('<rpc/>')
+            mock_rpc.assert_called_with('<rpc/>', 60)
+            self.nc_device.request('<rpc/>', timeout=30)
+            mock_rpc.assert_called_with('<rpc/>', 60)
+            self.nc_device.request('<rpc/>', timeout=120)
+            mock_rpc.assert_called_with('<rpc/>', 120)
+
     @patch('yang.connector.netconf.RawRPC', new=MyRawRPC)
     def test_request(self):
         self.nc_device._session = MySSHSession()
@@ -227,6 +336,87 @@ class TestYang(unittest.TestCase):
             '''
         self.assertEqual(generated_value, expected_value)
 
+    def test_request_async(self):
+        self.nc_device._session = MyReplySSHSession()
+        self.nc_device.connect()
+        r = '''<rpc message-id="101"
+            xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><commit/></rpc>'''
+        session = self.nc_device._session
+        senders = []
+        send = session.send
+        def record_send(message):
+            senders.append(threading.current_thread())
+            send(message)
+        session.send = record_send
+        reply = asyncio.run(self.nc_device.request_async(r, return_obj=True))
+        self.assertTrue(reply.ok)
+        self.assertEqual(reply.xml, MyReplySSHSession.reply)
+        # the send does not run on the event loop thread
+        self.assertEqual(len(senders), 1)
+        self.assertIsNot(senders[0], threading.current_thread())
+
+    def test_request_many(self):
+        self.nc_device._session = MyReplySSHSession()
+        self.nc_device.connect()
+        r = '''<rpc message-id="%d"
+            xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><commit/></rpc>'''
+        replies = self.nc_device.request_many(r % i for i in range(5))
+        self.assertEqual(replies, [MyReplySSHSession.reply.replace(
+            '101', str(i)) for i in range(5)])
+        with self.assertRaises(ValueError):
+            self.nc_device.request_many([r % 1, r % 1])
+        with self.assertRaisesRegex(ValueError, 'index 1'):
+            self.nc_device.request_many([r % 1, '<rpc><commit/></rpc>'])
+
+    def test_connect_async(self):
+        self.nc_device._session = MySSHSession()
+        asyncio.run(self.nc_device.connect_async())
+        self.assertTrue(self.nc_device.connected)
+
+    @patch.object(yang.connector.Netconf, '_create_session',
+                  lambda self, device_handler: MySSHSession())
+    def test_pool(self):
+        pool = yang.connector.NetconfPool(idle_timeout=60)
+        with pool.connection(self.device) as nc:
+            self.assertTrue(nc.connected)
+        self.assertIs(pool.acquire(self.device), nc)
+        pool.release(nc)
+
+        # same target from another testbed load
+        device = loader.load(self.yaml).devices['dummy']
+        with pool.connection(device) as nc2:
+            self.assertIs(nc2, nc)
+        self.assertIs(yang.connector.NetconfPool.shared(),
+                      yang.connector.NetconfPool.shared())
+
+        # dropped connections are replaced
+        nc.session.close()
+        nc2 = pool.acquire(self.device)
+        self.assertIsNot(nc2, nc)
+        self.assertTrue(nc2.connected)
+        pool.release(nc2)
+
+        # a connection past max_age is not handed out even when it was
+        # released after a newer one
+        new = pool.acquire(self.device)
+        old = pool.acquire(self.device)
+        key, created = pool._owned[old]
+        pool._owned[old] = (key, created - 50)
+        pool.release(new)
+        pool.release(old)
+        pool.max_age = 10
+        self.assertIs(pool.acquire(self.device), new)
+        self.assertFalse(old.connected)
+        pool.release(new)
+        pool.max_age = 3600
+
+        # expired connections are closed
+        pool.idle_timeout = 0
+        pool.release(pool.acquire(self.device))
+        self.assertFalse(nc2.connected)
+
+        pool.close()
+
     def test_rawrpc(self):
         from ncclient.operations.retrieve import GetReply
 
@@ -291,6 +481,275 @@ class TestYang(unittest.TestCase):
                           self.nc_device.execute,
                           'close')
 
+    def test_getattr(self):
+        self.assertTrue(callable(self.nc_device.get_config))
+        self.assertRaises(AttributeError,
+                          getattr, self.nc_device, 'no_such_operation')
+
+    def test_lazy_attribute(self):
+        self.assertIs(yang.connector.Netconf,
+                      yang.connector.netconf.Netconf)
+        self.assertIn('Gnmi', dir(yang.connector))
+        self.assertRaises(AttributeError,
+                          getattr, yang.connector, 'NoSuchConnector')
+
+    def test_import_defers_ncclient(self):
+        code = ('import sys, yang.connector; '
+                'sys.exit("ncclient" in sys.modules)')
+        ret = subprocess.run([sys.executable, '-c', code],
+                             cwd=os.path.dirname(os.path.dirname(
+                                 os.path.dirname(yang.connector.__file__))))
+        self.assertEqual(ret.returncode, 0)
+
+    def test_ssh_session_tuning(self):
+        session = self.nc_device.session
+        self.assertIsInstance(session, yang.connector.netconf.SSHSession)
+        self.assertEqual(session.window_size, 2**27)
+
+        sock1, sock2 = socket.socketpair()
+        try:
+            session._transport = paramiko.Transport(sock1)
+            self.assertIs(session.transport, session._transport)
+            self.assertEqual(session.transport.default_window_size, 2**27)
+            self.assertEqual(session.transport.default_max_packet_size, 2**15)
+        finally:
+            sock1.close()
+            sock2.close()
+
+    def test_ssh_session_nodelay(self):
+        session = self.nc_device.session
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        sock = socket.create_connection(server.getsockname())
+        try:
+            session._transport = paramiko.Transport(sock)
+            self.assertTrue(sock.getsockopt(socket.IPPROTO_TCP,
+                                            socket.TCP_NODELAY))
+        finally:
+            sock.close()
+            server.close()
+
+
+    def test_ssh_session_known_hosts(self):
+        key = paramiko.RSAKey.generate(1024)
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'known_hosts')
+            with open(filename, 'w') as f:
+                f.write('1.2.3.4 %s %s\n' % (key.get_name(), key.get_base64()))
+            h = DefaultDeviceHandler()
+            session1 = yang.connector.netconf.SSHSession(h)
+            session2 = yang.connector.netconf.SSHSession(h)
+            session1.load_known_hosts(filename)
+            session1.load_known_hosts(filename)
+            session2.load_known_hosts(filename)
+            self.assertIs(session1._host_keys, session2._host_keys)
+            self.assertTrue(session1._host_keys.check('1.2.3.4', key))
+
+    def test_ssh_session_send(self):
+        session = yang.connector.netconf.SSHSession(DefaultDeviceHandler())
+        session._connected = True
+        session._channel = Mock()
+        session.send('<rpc/>')
+        session._channel.sendall.assert_called_with(b'<rpc/>]]>]]>')
+        session.send(b'<rpc/>')
+        session._channel.sendall.assert_called_with(b'<rpc/>]]>]]>')
+        session._base = NetconfBase.BASE_11
+        session.send('<rpc/>')
+        session._channel.sendall.assert_called_with(b'\n#6\n<rpc/>\n##\n')
+        self.assertTrue(session._q.empty())
+
+        session._channel.reset_mock()
+        with session.batch():
+            session.send('<rpc/>')
+            session.send('<rpc/>')
+            session._channel.sendall.assert_not_called()
+        session._channel.sendall.assert_called_once_with(
+            b'\n#6\n<rpc/>\n##\n\n#6\n<rpc/>\n##\n')
+
+
+class TestNetconfEnxr(unittest.TestCase):
+
+    hello_10 = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<hello xmlns="urn:ietf:params:xml:ns:netconf:base:1.0">'
+                b'<capabilities><capability>'
+                b'urn:ietf:params:netconf:base:1.0'
+                b'</capability></capabilities></hello>]]>]]>')
+
+    def setUp(self):
+        self.enxr = yang.connector.netconf.NetconfEnxr()
+        popen = patch('yang.connector.netconf.subprocess.Popen')
+        self.proc = popen.start().return_value
+        self.proc.poll.return_value = None
+        self.addCleanup(popen.stop)
+        read = patch('yang.connector.netconf.os.read')
+        self.read = read.start()
+        self.addCleanup(read.stop)
+
+    hello_11 = hello_10.replace(
+        b'</capabilities>',
+        b'<capability>urn:ietf:params:netconf:base:1.1</capability>'
+        b'</capabilities>')
+
+    reply = '<rpc-reply message-id="101" ' \
+            'xmlns="urn:ietf:params:xml:ns:netconf:base:1.0"><ok/></rpc-reply>'
+
+    def test_connect_base_10(self):
+        self.read.side_effect = [self.hello_10[:50], self.hello_10[50:]]
+        self.assertEqual(self.enxr.connect(), 'NETCONF CONNECTED PIPE')
+        self.assertTrue(self.enxr.connected)
+        self.assertIsInstance(self.enxr.framer,
+                              yang.connector.netconf.EomFramer)
+        self.assertIn('urn:ietf:params:netconf:base:1.0',
+                      self.enxr.server_capabilities)
+        # whatever is available is read, up to bufsize
+        self.read.assert_called_with(self.proc.stdout.fileno(),
+                                     self.enxr.bufsize)
+
+        self.read.side_effect = [self.reply.encode()[:30],
+                                 self.reply.encode()[30:] + b']]>]]>']
+        reply = self.enxr.send_cmd('<rpc message-id="101"><commit/></rpc>')
+        self.assertEqual(reply.xml, self.reply)
+        self.proc.stdin.write.assert_called_with(
+            b'<rpc message-id="101"><commit/></rpc>]]>]]>')
+
+    def test_connect_base_11(self):
+        self.read.side_effect = [self.hello_11]
+        self.enxr.connect()
+        self.assertIsInstance(self.enxr.framer,
+                              yang.connector.netconf.ChunkedFramer)
+
+        data = self.reply.encode()
+        self.read.side_effect = [b'\n#%d\n' % len(data) + data + b'\n##\n']
+        reply = self.enxr.send_cmd('<rpc message-id="101"><commit/></rpc>')
+        self.assertEqual(reply.xml, self.reply)
+        self.proc.stdin.write.assert_called_with(
+            b'\n#37\n<rpc message-id="101"><commit/></rpc>\n##\n')
+
+    def test_reply_with_hello(self):
+        self.read.side_effect = [
+            self.hello_10 + self.reply.encode() + b']]>]]>']
+        self.enxr.connect()
+        reply = self.enxr.send_cmd('<rpc message-id="101"><commit/></rpc>')
+        self.assertEqual(reply.xml, self.reply)
+        self.read.assert_called_once()
+
+    def test_request_many(self):
+        self.read.side_effect = [self.hello_11]
+        self.enxr.connect()
+        data = self.reply.encode()
+        frame = b'\n#%d\n' % len(data) + data + b'\n##\n'
+        self.read.side_effect = [frame + frame[:10], frame[10:]]
+        replies = self.enxr.request_many(
+            ['<rpc message-id="101"><commit/></rpc>'] * 2)
+        self.assertEqual([r.xml for r in replies], [self.reply] * 2)
+        # both rpcs go out in a single write
+        self.proc.stdin.write.assert_called_with(
+            b'\n#37\n<rpc message-id="101"><commit/></rpc>\n##\n' * 2)
+
+    def test_connect_no_hello(self):
+        self.read.side_effect = [b'<hello', b'']
+        self.assertIsNone(self.enxr.connect())
+        self.assertFalse(self.enxr.connected)
+        self.proc.terminate.assert_called_once_with()
+        self.proc.wait.assert_called_once_with()
+
+    def test_reconnect_failed(self):
+        self.read.side_effect = [self.hello_10, b'<hello/>]]>]]>']
+        self.enxr.connect()
+        self.assertTrue(self.enxr.connected)
+        self.proc.stdin.write.side_effect = BrokenPipeError
+        self.assertEqual(self.enxr.connect(),
+                         'Not connected, Something went wrong')
+        self.assertFalse(self.enxr.connected)
+        self.assertIsNone(self.enxr.framer)
+        self.proc.terminate.assert_called_once_with()
+        self.proc.wait.assert_called_once_with()
+
+
+class TestNcclientHooks(unittest.TestCase):
+    """SSHSession overrides ncclient internals, fail loudly if they move."""
+
+    def test_session_hooks(self):
+        self.assertTrue(hasattr(transport.SSHSession, '_transport_read'))
+        run = inspect.getsource(transport.Session.run)
+        self.assertIn('self._transport_read()', run)
+        self.assertIn('self.parser.parse(', run)
+        self.assertIn('self._q', run)
+
+        session = transport.SSHSession(DefaultDeviceHandler())
+        for name in ('parser', '_base', '_buffer', '_q', '_transport'):
+            self.assertIn(name, vars(session))
+
+
+class TestFramedParser(unittest.TestCase):
+
+    def setUp(self):
+        self.session = yang.connector.netconf.SSHSession(
+            DefaultDeviceHandler())
+        self.messages = []
+        self.session._dispatch_message = self.messages.append
+
+    def test_installed(self):
+        self.assertIsInstance(self.session.parser,
+                              yang.connector.netconf.FramedParser)
+        parser = self.session.parser
+        self.session.parser = self.session._device_handler.get_xml_parser(
+            self.session)
+        self.assertIs(self.session.parser, parser)
+
+    def test_split_multibyte(self):
+        data = '<hello>é</hello>]]>]]><a>ü</a>]]>]]>'.encode('utf-8')
+        for i in range(len(data)):
+            self.session.parser.parse(data[i:i + 1])
+        self.assertEqual(self.messages, ['<hello>é</hello>', '<a>ü</a>'])
+
+    def test_base_11(self):
+        self.session.parser.parse(b'<hello/>]]>]]>\n#4\n<a/')
+        self.session._base = NetconfBase.BASE_11
+        self.session.parser.parse(b'>\n##\n')
+        self.assertEqual(self.messages, ['<hello/>', '<a/>'])
+
+
+class TestEomFramer(unittest.TestCase):
+
+    def test_split_reads(self):
+        framer = yang.connector.netconf.EomFramer()
+        data = b'<a/>]]>]]><b/>]]>]]>'
+        messages = []
+        for i in range(len(data)):
+            messages += framer.feed(data[i:i + 1])
+        self.assertEqual(messages, [b'<a/>', b'<b/>'])
+        self.assertEqual(framer.feed(b'<c/>]]>]]>'), [b'<c/>'])
+
+
+class TestChunkedFramer(unittest.TestCase):
+
+    def test_split_reads(self):
+        framer = yang.connector.netconf.ChunkedFramer()
+        data = '\n#5\n<a>é\n#8\n####</a>\n##\n\n#4\n<b/>'.encode()
+        messages = []
+        for i in range(len(data)):
+            messages += framer.feed(data[i:i + 1])
+        self.assertEqual(messages, ['<a>é####</a>'.encode()])
+        self.assertEqual(framer.feed(b'\n##\n'), [b'<b/>'])
+
+    def test_multiple_messages(self):
+        framer = yang.connector.netconf.ChunkedFramer()
+        messages = framer.feed(b'\n#3\n<a>\n##\n\n#4\n<b/>\n##\n')
+        self.assertEqual(messages, [b'<a>', b'<b/>'])
+
+    def test_encode(self):
+        framer = yang.connector.netconf.ChunkedFramer()
+        data = '<rpc>é</rpc>'.encode('utf-8')
+        self.assertEqual(framer.feed(framer.encode(data)), [data])
+
+    def test_invalid_size(self):
+        framer = yang.connector.netconf.ChunkedFramer()
+        self.assertRaises(ValueError, framer.feed, b'\n#12345678901\n')
+        framer = yang.connector.netconf.ChunkedFramer()
+        self.assertRaises(ValueError, framer.feed, b'\n#0\n')
+
 
 if __name__ == '__main__':
     unittest.main()
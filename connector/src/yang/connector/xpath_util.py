@@ -1,8 +1,7 @@
 import os
 import re
-import json
 import logging
-from six import string_types
+import functools
 from . import proto
 
 log = logging.getLogger(__name__)
@@ -49,20 +48,24 @@ def combine_configs(payload, last_xpath, cfg):
     return payload
 
 
-def xpath_to_json(configs, last_xpath="", payload={}):
-    """Try to combine Xpaths/values into a common payload (recursive).
+def xpath_to_json(configs, last_xpath="", payload=None):
+    """Try to combine Xpaths/values into a common payload.
 
     Parameters
     ----------
     configs: tuple of xpath/value dict
-    last_xpath: str of last xpath that was recusivly processed.
-    payload: dict being recursively built for JSON transformation.
+    last_xpath: str of last xpath that was processed.
+    payload: dict being built for JSON transformation.
 
     Returns
     -------
     dict of combined xpath/value dict.
     """
-    for i, cfg in enumerate(configs, 1):
+    if payload is None:
+        payload = {}
+    # Walked in a loop rather than recursing once per config, which also
+    # copied the rest of configs at every level.
+    for cfg in configs:
         xpath, config, is_key = cfg
         if last_xpath and xpath not in last_xpath:
             # Branched config here     |---config
@@ -70,32 +73,31 @@ def xpath_to_json(configs, last_xpath="", payload={}):
             # --|                      |---config
             #   |---this xpath config
             payload = combine_configs(payload, last_xpath, cfg)
-            return xpath_to_json(configs[i:], xpath, payload)
-        xpath_segs = xpath.split("/")
-        xpath_segs.reverse()
-        for seg in xpath_segs:
-            if not seg:
-                continue
-            if payload:
-                if is_key:
-                    if seg in payload:
-                        if isinstance(payload[seg], list):
-                            payload[seg].append(config)
-                        elif isinstance(payload[seg], dict):
-                            payload[seg].update(config)
-                    else:
-                        payload.update(config)
-                        payload = {seg: [payload]}
+            last_xpath = xpath
+            continue
+        # Only the last segment of the xpath is used
+        seg = next((seg for seg in reversed(xpath.split("/")) if seg), None)
+        if seg is None:
+            continue
+        if payload:
+            if is_key:
+                if seg in payload:
+                    if isinstance(payload[seg], list):
+                        payload[seg].append(config)
+                    elif isinstance(payload[seg], dict):
+                        payload[seg].update(config)
                 else:
-                    config.update(payload)
-                    payload = {seg: config}
-                return xpath_to_json(configs[i:], xpath, payload)
+                    payload.update(config)
+                    payload = {seg: [payload]}
             else:
-                if is_key:
-                    payload = {seg: [config]}
-                else:
-                    payload = {seg: config}
-                return xpath_to_json(configs[i:], xpath, payload)
+                config.update(payload)
+                payload = {seg: config}
+        else:
+            if is_key:
+                payload = {seg: [config]}
+            else:
+                payload = {seg: config}
+        last_xpath = xpath
     return payload
 
 
@@ -103,6 +105,45 @@ def xpath_to_json(configs, last_xpath="", payload={}):
 RE_FIND_KEYS = re.compile(r"\[.*?\]")
 
 
+@functools.lru_cache(maxsize=32)
+def _prefix_re(prefixes):
+    """Compile one pattern matching any of the "<prefix>:" tokens.
+
+    Longer prefixes are tried first so "oc-if" wins over "oc" at the
+    same position.
+    """
+    prefixes = sorted(prefixes, key=len, reverse=True)
+    return re.compile("(" + "|".join(map(re.escape, prefixes)) + "):")
+
+
+def common_xpath_prefix(xpaths):
+    """Longest common prefix of xpaths that ends on a segment boundary.
+
+    os.path.commonprefix works per character, so /a/bar and /a/baz would
+    give /a/ba. Back off to where every xpath continues with "/" or a key,
+    or ends, and never stop inside a key.
+
+    Parameters
+    ----------
+    xpaths: list of str Xpaths
+
+    Returns
+    -------
+    str common Xpath, may be empty.
+    """
+    prefix = os.path.commonprefix(xpaths)
+    while prefix:
+        if prefix.count("[") > prefix.count("]"):
+            # part way through a key
+            prefix = prefix[:prefix.rfind("[")]
+            continue
+        end = len(prefix)
+        if all(len(xpath) == end or xpath[end] in "/[" for xpath in xpaths):
+            break
+        prefix = prefix[:-1]
+    return prefix
+
+
 def get_payload(configs):
     """Common Xpaths were detected so try to consolidate them.
 
@@ -172,7 +213,7 @@ def get_payload(configs):
                 xpaths.append(xpath)
 
         # Now get the update path for this batch of configs
-        common_xpath = os.path.commonprefix(xpaths)
+        common_xpath = common_xpath_prefix(xpaths)
         cfg_compressed = []
         keys = []
 
@@ -197,7 +238,7 @@ def get_payload(configs):
             for key in keys:
                 if [k for k in config.keys() if k in key]:
                     is_key = True
-            keys += re.findall(RE_FIND_KEYS, end_path)
+            keys += RE_FIND_KEYS.findall(end_path)
             cfg_compressed.append((end_path, config, is_key))
             compressed_count += 1
 
@@ -274,6 +315,23 @@ def xml_path_to_path_elem(request, prefix=False):
             if module:
                 namespace_modules[prefix] = module
 
+        # Origin and xpath replacement for each prefix, worked out once
+        # per request instead of once per node.
+        prefixes = {}
+        for pfx, mod in namespace_modules.items():
+            pfx_origin = None
+            if "Cisco-IOS-" in mod:
+                pfx_origin = 'rfc7951'
+                mod += ":"
+            elif 'openconfig' in mod:
+                pfx_origin = 'openconfig'
+                mod = ''
+            elif 'Cisco-NX-OS' in mod:
+                pfx_origin = 'device'
+                mod = ''
+            prefixes[pfx] = (pfx_origin, mod)
+        prefix_re = _prefix_re(tuple(prefixes)) if prefixes else None
+
         for node in request.get("nodes", []):
             if "xpath" not in node:
                 log.error("Xpath is not in message")
@@ -282,48 +340,66 @@ def xml_path_to_path_elem(request, prefix=False):
                 value = node.get("value", "")
                 edit_op = node.get("edit-op", "")
 
-                for pfx, mod in namespace_modules.items():
-                    if pfx not in xpath:
-                        continue
-                    if "Cisco-IOS-" in mod:
-                        origin = 'rfc7951'
-                        mod += ":"
-                    elif 'openconfig' in mod:
-                        origin = 'openconfig'
-                        mod = ''
-                    elif 'Cisco-NX-OS' in mod:
-                        origin = 'device'
-                        mod = ''
-                    # Adjust prefixes of xpaths
-                    xpath = xpath.replace(pfx + ":", mod)
-                    if isinstance(value, string_types):
-                        value = value.replace(pfx + ":", mod)
+                used = set()
+                for pfx, (pfx_origin, mod) in prefixes.items():
+                    if pfx in xpath:
+                        used.add(pfx)
+                        if pfx_origin:
+                            origin = pfx_origin
+                if used:
+                    # Adjust prefixes of xpaths in a single pass; values
+                    # only have the prefixes that appear in the xpath
+                    # adjusted.
+                    def adjust(match):
+                        pfx = match.group(1)
+                        if pfx in used:
+                            return prefixes[pfx][1]
+                        return match.group(0)
+                    xpath = prefix_re.sub(adjust, xpath)
+                    if isinstance(value, str):
+                        value = prefix_re.sub(adjust, value)
 
                 if edit_op:
                     if edit_op in ["create", "merge", "replace"]:
-                        xpath_lst = xpath.split("/")
-                        name = xpath_lst.pop()
-                        xpath = "/".join(xpath_lst)
+                        xpath, _, name = xpath.rpartition("/")
                         if edit_op == "replace":
-                            if not message["replace"]:
-                                message["replace"] = [{xpath: {name: value}}]
-                            else:
-                                message["replace"].append({xpath: {name: value}})
+                            message["replace"].append({xpath: {name: value}})
                         else:
-                            if not message["update"]:
-                                message["update"] = [{xpath: {name: value}}]
-                            else:
-                                message["update"].append({xpath: {name: value}})
+                            message["update"].append({xpath: {name: value}})
                     elif edit_op in ["delete", "remove"]:
-                        if message["delete"]:
-                            message["delete"].add(xpath)
-                        else:
-                            message["delete"] = set(xpath)
+                        message["delete"].append(xpath)
                 else:
                     message["get"].append(xpath)
     return namespace_modules, message, origin
 
 
+def path_to_xpath(path, prefix=None):
+    """Convert a gNMI Path to an Xpath, reading the proto fields directly.
+
+    Keys are added in name order, e.g. /interfaces/interface[name="Gi1"].
+
+    Parameters
+    ----------
+    path: proto.gnmi_pb2.Path of an update.
+    prefix: proto.gnmi_pb2.Path prefix of the notification, optional.
+
+    Returns
+    -------
+    str Xpath.
+    """
+    elems = list(prefix.elem) if prefix is not None else []
+    elems.extend(path.elem)
+    segs = []
+    for elem in elems:
+        if elem.key:
+            segs.append(elem.name + "".join(
+                '[{0}="{1}"]'.format(k, elem.key[k]) for k in sorted(elem.key)
+            ))
+        else:
+            segs.append(elem.name)
+    return "/" + "/".join(segs)
+
+
 if __name__ == "__main__":
     from pprint import pprint as pp
 